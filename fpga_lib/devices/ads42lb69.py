@@ -12,6 +12,7 @@ class ADS42LB69(FieldWriter):
     def write_config(self):
         # Software reset of ADC
         self._write(0x08, 0x01)
+        self._reset_image()
 
         self.enable_write()
         self._write_fields()
@@ -6,6 +6,8 @@ from .reg_fields import FieldWriter
 
 class LMK04616(FieldWriter):
     _DeviceName = 'LMK04616'
+    _WriteFieldRange = (0, 0x153)
+    _StartRegisters = (0x011, 0x0AD)
 
     def dummy_writer(self, offset, value):
         print('PLL[%03X] <= %02X' % (offset, value))
@@ -15,15 +17,21 @@ class LMK04616(FieldWriter):
     def write_config(self):
         # Trigger soft reset
         self._write(0x000, 0x81)
+        self._reset_image()
 
         # Write all the fields in sequence
         self.enable_write()
-        self._write_fields((0, 0x153))
+        self._write_fields()
+        self._start_device()
 
-        # Enable start; this is a register bypass
-        self._write(0x011, 1)
+    # Starts the device after the fields have been written.  These registers
+    # are part of the image, so they are written through it to keep track of
+    # the values now on the device; _reset_image restores their defaults.
+    def _start_device(self):
+        # Enable start
+        self._write_register(0x011, 1)
 
         # Enable PLL2 digital lock detect
-        self._write(0xAD, 0x30)
+        self._write_register(0xAD, 0x30)
         time.sleep(0.1)
-        self._write(0xAD, 0)
+        self._write_register(0xAD, 0)
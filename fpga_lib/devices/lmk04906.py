@@ -14,6 +14,7 @@ class LMK04906(FieldWriter):
         # Start by triggering a reset of the LMK.  We bypass the register
         # interface for this special operation.
         self._write(0, 1 << 17)
+        self._reset_image()
 
         # Now write all the fields in sequence
         self.enable_write()
@@ -4,7 +4,7 @@ from __future__ import print_function
 
 from collections import namedtuple, OrderedDict
 
-__all__ = ['parse_regs', 'Register', 'Constant', 'Group']
+__all__ = ['parse_regs', 'parse_profile', 'Register', 'Constant', 'Group']
 
 
 # Types of register definition
@@ -104,6 +104,21 @@ def parse_regs(reg_file):
     return reg_map
 
 
+# Parses a profile of field values, each line giving a field name and value.
+def parse_profile(profile_file):
+    values = OrderedDict()
+    for line_no, name, defs in parse_lines(profile_file):
+        try:
+            assert name not in values, 'Duplicate name %r' % name
+            assert len(defs) == 1 and len(defs[0]) == 1, \
+                'Malformed profile entry'
+            values[name] = int0(defs[0][0])
+        except Exception as e:
+            print('Line %d: %s' % (line_no, e))
+            raise
+    return values
+
+
 def format_Constant(constant):
     print('0x%02X 0x%08X' % (constant.register, constant.value))
 
@@ -1,98 +1,313 @@
 # Helper script for interfacing to packed fields in a hardware device
 
 import os
+import sys
 from collections import namedtuple, OrderedDict
 import copy
 
+import numpy
+
+from fpga_lib.parse import cache
+
 from .parse_regs import *
+from . import parse_regs as _parse_regs
 
 
 Field = namedtuple('Field', ['register', 'offset', 'width', 'read_only'])
 
+# The register layout of a device: a dictionary mapping field names to field
+# definitions, a FieldTable, and the default register image.  The image is an
+# array of register values indexed by register number together with a mask of
+# the registers which are defined.
+Layout = namedtuple('Layout', ['fields', 'table', 'image', 'defined'])
+
+# All the sub-fields of all fields flattened into arrays for vectorised access.
+# The sub-fields of each field are stored contiguously from start[name] in the
+# same order as the field definitions, and position is the bit position of the
+# sub-field within the field value.  The total width of each field is width[name].
+FieldTable = namedtuple('FieldTable', [
+    'start', 'count', 'width',
+    'register', 'shift', 'mask', 'position', 'read_only'])
+
 
 def _make_field(reg):
     return Field(reg.register, reg.offset, reg.width, reg.read_only)
 
 
+# A field definition is either a single field definition:
+#   (register, offset, width, default)
+# or a list of sub-fields:
+#   [(r1, o1, w1, d1), ..., (rn, on, wn, dn)]
+# We normalise this, extracting the default as a single integer value and
+# returning a list of sub-fields in reverse order:
+#   default, [(rn, on, wn), ..., (r1, o1, w1)]
+def _compute_fields(field):
+    # Convert field into working format: a field value followed by a
+    # list of register sub-fields in byte order.  At this point we need to
+    # separate single byte and multiple byte definitions.
+    if isinstance(field, Register):
+        # Simple case: single field
+        default = field.value
+        fields = (_make_field(field),)
+        read_only = field.read_only
+    else:
+        # More complicated.
+        # First assemble the default value
+        field = field.registers
+        default = field[0].value
+        read_only = field[0].read_only
+        for f in field[1:]:
+            default = (default << f.width) | f.value
+            read_only = read_only or f.read_only
+
+        # Next extract the list of field definitions in little endian order
+        # for register generation.
+        fields = tuple(reversed([_make_field(f) for f in field]))
+    return fields, default, read_only
+
+
+# Computes the register layout from the given register definitions file.  The
+# default image is assembled by writing each default field value in turn, and
+# constants initialise individual registers.
+def _compute_layout(regs_file):
+    fields = OrderedDict()
+    registers = {}
+    defaults = {}
+    for name, rdef in parse_regs(regs_file).items():
+        if isinstance(rdef, (Register, Group)):
+            field, value, read_only = _compute_fields(rdef)
+            fields[name] = field
+            defaults[name] = value
+            if not read_only:
+                for f in field:
+                    field_mask = ((1 << f.width) - 1) << f.offset
+                    registers[f.register] = \
+                        registers.get(f.register, 0) & ~field_mask | \
+                        (value << f.offset) & field_mask
+                    value >>= f.width
+                assert value == 0, 'Value for %s too large for field' % name
+        elif isinstance(rdef, Constant):
+            # Constants are used to initialise individual registers.  The
+            # register name is not saved
+            registers[rdef.register] = rdef.value
+        else:
+            assert False, 'Invalid register definition'
+
+    size = max(
+        list(registers) +
+        [f.register for field in fields.values() for f in field]) + 1
+    image = numpy.zeros(size, dtype = numpy.uint32)
+    defined = numpy.zeros(size, dtype = bool)
+    image[list(registers)] = list(registers.values())
+    defined[list(registers)] = True
+    return Layout(fields, _compute_table(fields), image, defined)
+
+
+def _compute_table(fields):
+    start = {}
+    count = {}
+    width = {}
+    subfields = []
+    for name, field in fields.items():
+        start[name] = len(subfields)
+        count[name] = len(field)
+        position = 0
+        for f in field:
+            subfields.append(
+                (f.register, f.offset, (1 << f.width) - 1, position,
+                    f.read_only))
+            position += f.width
+        width[name] = position
+    register, shift, mask, position, read_only = \
+        zip(*subfields) if subfields else ((),) * 5
+    return FieldTable(start, count, width,
+        numpy.array(register, dtype = numpy.intp),
+        numpy.array(shift, dtype = numpy.uint32),
+        numpy.array(mask, dtype = numpy.uint32),
+        numpy.array(position, dtype = numpy.uint64),
+        numpy.array(read_only, dtype = bool))
+
+
+# Writes a dictionary of field values into the given register image and mask of
+# defined registers in a single vectorised update.  Returns the sorted array of
+# updated registers.
+def _apply_values(table, image, defined, values):
+    names = list(values)
+    for name in names:
+        assert name in table.start, 'Cannot write to attribute %s' % name
+    starts = numpy.array(
+        [table.start[name] for name in names], dtype = numpy.intp)
+    counts = numpy.array(
+        [table.count[name] for name in names], dtype = numpy.intp)
+
+    # Index of each sub-field and the field it belongs to
+    rows = numpy.repeat(numpy.arange(len(names)), counts)
+    subfields = starts[rows] + numpy.arange(len(rows)) - \
+        numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    read_only = table.read_only[subfields]
+    assert not read_only.any(), \
+        'Cannot write to read-only register %s' % names[rows[read_only][0]]
+
+    field_values = numpy.array(
+        [values[name] for name in names], dtype = numpy.uint64)
+    widths = numpy.array(
+        [table.width[name] for name in names], dtype = numpy.uint64)
+    too_large = (field_values >> widths) != 0
+    assert not too_large.any(), \
+        'Value for %s too large for field' % names[numpy.argmax(too_large)]
+
+    registers = table.register[subfields]
+    shifts = table.shift[subfields]
+    masks = table.mask[subfields]
+    parts = ((field_values[rows] >> table.position[subfields]) &
+        masks).astype(numpy.uint32)
+    numpy.bitwise_and.at(image, registers, ~(masks << shifts))
+    numpy.bitwise_or.at(image, registers, parts << shifts)
+    defined[registers] = True
+    return numpy.unique(registers)
+
+
+# Layouts are computed once per definitions file, and are also cached on disk.
+_layouts = {}
+
+def _load_layout(regs_file):
+    try:
+        return _layouts[regs_file]
+    except KeyError:
+        key = cache.cache_key('regs',
+            [regs_file, __file__, _parse_regs.__file__], sys.version)
+        layout = cache.cached(key, lambda: _compute_layout(regs_file))
+        _layouts[regs_file] = layout
+        return layout
+
+
+# A profile is a file of field overrides in .regs syntax, one field per line:
+#
+#   FIELD_NAME  value
+#
+# Each profile is compiled once into a complete register image by applying the
+# overrides to the default image of the device.  Compiled images are kept in
+# memory keyed by path, as for layouts, and on disk keyed by the contents of the
+# profile and .regs files.
+Profile = namedtuple('Profile', ['values', 'image', 'defined'])
+
+_profiles = {}
+
+def _compile_profile(regs_file, profile_file):
+    layout = _load_layout(regs_file)
+    values = parse_profile(profile_file)
+    image = layout.image.copy()
+    defined = layout.defined.copy()
+    _apply_values(layout.table, image, defined, values)
+    return Profile(values, image, defined)
+
+def _load_profile(regs_file, profile_file):
+    try:
+        return _profiles[(regs_file, profile_file)]
+    except KeyError:
+        key = cache.cache_key('profile',
+            [regs_file, profile_file, __file__, _parse_regs.__file__],
+            sys.version)
+        profile = cache.cached(
+            key, lambda: _compile_profile(regs_file, profile_file))
+        _profiles[(regs_file, profile_file)] = profile
+        return profile
+
+
 # This class is used to map logical packed fields to hardware registers.
 # This class should be subclassed and _DeviceName defined
 class FieldWriter(object):
-    # Register definitions will be read from the given file
+    # Registers written by _start_device.  After a reset these hold their
+    # default values, so the full write sequence leaves the device stopped
+    # until _start_device runs, and profiles do not change them.
+    _StartRegisters = ()
+
+    # Register definitions will be read from the given file.  If the device
+    # implements write_block(start, values) then runs of consecutive registers
+    # are written to it in a single block write.
     def __init__(self, device = None, mode = 'rw'):
         # Set up read and write actions.  Use dummy write to display if no
         # device or mode is not writeable
         self._write = self.dummy_writer
+        self._write_block = None
         self._read = None
         if device is not None:
             if 'r' in mode:
                 self._read = device.read
             if 'w' in mode:
                 self._write = device.write
+                self._write_block = getattr(device, 'write_block', None)
         self._hardware = device
 
+        # The register layout is shared by all instances of the device, each
+        # instance starts with a copy of the default image with every register
+        # marked as dirty.
+        layout = _load_layout(self.__register_defs_file())
         self.__live = False     # Switch between cached and direct access
-        self.__registers = {}   # Maps register numbers to values
-        self.__dirty = set()    # Set of changed registers
-        self.__fields = {}      # Maps names to definitions
-
-        # Walk the register definitions
-        for name, rdef in self.__load_register_defs().items():
-            if isinstance(rdef, (Register, Group)):
-                fields, default, read_only = self.__compute_fields(rdef)
-                self.__fields[name] = fields
-                if not read_only:
-                    self.__write_value(name, default)
-            elif isinstance(rdef, Constant):
-                # Constants are used to initialise individual registers.  The
-                # register name is not saved
-                self._write_register(rdef.register, rdef.value)
-            else:
-                assert False, 'Invalid register definition'
-
-
-    def __load_register_defs(self):
+        self.__fields = layout.fields   # Maps names to definitions
+        self.__table = layout.table     # Vectorised field definitions
+        # Register image and the mask of registers present in the image
+        self.__registers = layout.image.copy()
+        self.__default = layout.image
+        self.__defined = layout.defined.copy()
+        # Mask of changed registers
+        self.__dirty = layout.defined.copy()
+        # Register values known to be on hardware and the mask of known values
+        self.__written = numpy.zeros_like(layout.image)
+        self.__known = numpy.zeros_like(layout.defined)
+
+
+    def __register_defs_file(self):
         device_name = self._DeviceName
         if '/' not in device_name:
             # Look for the specified device in the current directory
             here = os.path.dirname(__file__)
             device_name = os.path.join(here, device_name + '.regs')
-        return parse_regs(device_name)
-
-    # A field definition is either a single field definition:
-    #   (register, offset, width, default)
-    # or a list of sub-fields:
-    #   [(r1, o1, w1, d1), ..., (rn, on, wn, dn)]
-    # We normalise this, extracting the default as a single integer value and
-    # returning a list of sub-fields in reverse order:
-    #   default, [(rn, on, wn), ..., (r1, o1, w1)]
-    def __compute_fields(self, field):
-        # Convert field into working format: a field value followed by a
-        # list of register sub-fields in byte order.  At this point we need to
-        # separate single byte and multiple byte definitions.
-        if isinstance(field, Register):
-            # Simple case: single field
-            default = field.value
-            fields = (_make_field(field),)
-            read_only = field.read_only
-        else:
-            # More complicated.
-            # First assemble the default value
-            field = field.registers
-            default = field[0].value
-            read_only = field[0].read_only
-            for f in field[1:]:
-                default = (default << f.width) | f.value
-                read_only = read_only or f.read_only
-
-            # Next extract the list of field definitions in little endian order
-            # for register generation.
-            fields = tuple(reversed([_make_field(f) for f in field]))
-        return fields, default, read_only
+        return device_name
 
     # Call this to enable writing to hardware
     def enable_write(self, live = True):
         self.__live = live
 
+    # Call this after resetting the device: the hardware registers are no
+    # longer known and so all registers will be written by _write_fields.
+    def _reset_image(self):
+        start = list(self._StartRegisters)
+        self.__registers[start] = self.__default[start]
+        self.__known[:] = False
+        self.__dirty |= self.__defined
+
+    # Writes only the registers which differ from the values last written to
+    # the device, or does a full write_config if the device state is unknown.
+    def update_config(self, verify = False):
+        if self.__known.any():
+            self.enable_write()
+            if self._write_fields(verify = verify):
+                self._start_device()
+        else:
+            self.write_config()
+
+    # Called after the fields have been written by write_config or changed by
+    # update_config for any device specific sequence which must follow, such as
+    # restarting the device.  Nothing is needed by default.
+    def _start_device(self):
+        pass
+
+    # Switches to the register image compiled from the given profile file, see
+    # _load_profile.  Any other field changes are discarded, but the start
+    # registers are left alone.  If write is set the device is then updated by
+    # update_config.
+    def select_profile(self, profile_file, write = True, verify = False):
+        profile = _load_profile(self.__register_defs_file(), profile_file)
+        selected = profile.defined.copy()
+        selected[list(self._StartRegisters)] = False
+        changed = selected & (self.__registers != profile.image)
+        self.__registers[selected] = profile.image[selected]
+        self.__defined |= selected
+        self.__dirty |= changed
+        if write:
+            self.update_config(verify)
+
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     # Field and register access, in three tiers of implementation:
@@ -113,11 +328,30 @@ class FieldWriter(object):
     # Writes single register to hardware or to cache if not live
     def _write_register(self, reg, value):
         self.__registers[reg] = value
+        self.__defined[reg] = True
         if self.__live:
             self._write(reg, value)
-            self.__dirty.discard(reg)
+            self.__written[reg] = value
+            self.__known[reg] = True
+            self.__dirty[reg] = False
+        else:
+            self.__dirty[reg] = True
+
+    # Writes block of consecutive registers from start, using a single block
+    # write if the device supports this.  The registers are only recorded as
+    # written once the block write has succeeded.
+    def _write_registers(self, start, values):
+        if not self.__live or self._write_block is None or len(values) == 1:
+            for reg, value in enumerate(values, start):
+                self._write_register(reg, value)
         else:
-            self.__dirty.add(reg)
+            block = numpy.s_[start:start + len(values)]
+            self.__registers[block] = values
+            self.__defined[block] = True
+            self._write_block(start, values)
+            self.__written[block] = values
+            self.__known[block] = True
+            self.__dirty[block] = False
 
     # Reads single register from hardware or from cached value
     # Not currently supported
@@ -125,10 +359,14 @@ class FieldWriter(object):
         if self.__live:
             value = self._read(reg)
             self.__registers[reg] = value
-            self.__dirty.discard(reg)
+            self.__defined[reg] = True
+            self.__written[reg] = value
+            self.__known[reg] = True
+            self.__dirty[reg] = False
             return value
         else:
-            return self.__registers.setdefault(reg, 0)
+            self.__defined[reg] = True
+            return int(self.__registers[reg])
 
 
     # Updates the registers associated with the given named field.
@@ -175,18 +413,90 @@ class FieldWriter(object):
 
 
     # This should be called after creation to write the initial state to
-    # hardware in the correct order.  All defined registers in the given range
-    # are written in sequence.
-    def _write_fields(self, range = None):
+    # hardware in the correct order.  All changed registers in the given range
+    # are written in sequence, with runs of consecutive registers written as a
+    # block where possible.  Registers already holding the wanted value on the
+    # hardware are skipped.  If verify is set the written registers are read
+    # back and checked.  Returns the number of registers written.
+    def _write_fields(self, range = None, verify = False):
         assert self.__live
         if range is None:
             # Pick up default range from subclass definition
             first, last = self._WriteFieldRange
         else:
             first, last = range
-        for reg in sorted(self.__dirty):
-            if first <= reg <= last:
-                self._write_register(reg, self.__registers[reg])
+        # Clear the dirty flag of registers already holding the wanted value,
+        # note that dirty is a view of our dirty mask.
+        block = numpy.s_[first:last + 1]
+        dirty = self.__dirty[block]
+        dirty &= ~(self.__known[block] &
+            (self.__written[block] == self.__registers[block]))
+        changed = numpy.flatnonzero(dirty) + first
+        self.__write_runs(changed)
+
+        if verify:
+            assert self._read is not None, 'Cannot verify without read access'
+            for reg in map(int, changed):
+                value = self._read(reg)
+                assert value == self.__registers[reg], \
+                    'Register %d read back as %X, expected %X' % (
+                        reg, value, self.__registers[reg])
+        return len(changed)
+
+    # Writes the given sorted array of registers to hardware as runs of
+    # consecutive registers.
+    def __write_runs(self, registers):
+        breaks = numpy.flatnonzero(numpy.diff(registers) != 1) + 1
+        for run in numpy.split(registers, breaks):
+            if len(run):
+                self._write_registers(
+                    int(run[0]), [int(value) for value in self.__registers[run]])
+
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    # Bulk access to fields and the register image
+
+    # Writes a dictionary of field values in a single vectorised update of the
+    # register image.  If live the updated registers are then written in order.
+    def _write_values(self, values):
+        updated = _apply_values(
+            self.__table, self.__registers, self.__defined, values)
+        if self.__live:
+            self.__write_runs(updated)
+        else:
+            self.__dirty[updated] = True
+
+    # Returns a dictionary of the given field values read from the register
+    # image, by default all fields.
+    def _read_values(self, names = None):
+        table = self.__table
+        if names is None:
+            names = list(self.__fields)
+        starts = numpy.array(
+            [table.start[name] for name in names], dtype = numpy.intp)
+        counts = numpy.array(
+            [table.count[name] for name in names], dtype = numpy.intp)
+        rows = numpy.repeat(numpy.arange(len(names)), counts)
+        subfields = starts[rows] + numpy.arange(len(rows)) - \
+            numpy.repeat(numpy.cumsum(counts) - counts, counts)
+
+        parts = (self.__registers[table.register[subfields]] >>
+            table.shift[subfields]) & table.mask[subfields]
+        values = numpy.zeros(len(names), dtype = numpy.uint64)
+        numpy.bitwise_or.at(values, rows,
+            parts.astype(numpy.uint64) << table.position[subfields])
+        return OrderedDict(zip(names, map(int, values)))
+
+    # Returns a copy of the register image as an array indexed by register
+    # number.  Registers not defined by the device read as zero.
+    def _get_image(self):
+        return numpy.where(self.__defined, self.__registers, 0)
+
+    # Returns the array of registers which differ between our register image and
+    # the given image.
+    def _diff_image(self, image):
+        return numpy.flatnonzero(
+            self.__defined & (self.__registers != image))
 
 
     # Returns a list of all the field names
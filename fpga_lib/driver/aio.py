@@ -0,0 +1,90 @@
+# Asyncio support for waiting for register events and reading DMA data
+#
+# The functions here take any object with a fileno() method, such as
+# RawRegisters or the reader returned by RawRegisters.reader(), or a plain file
+# descriptor.  The descriptor is registered with the running event loop, so many
+# cards can be served from a single loop.  For example:
+#
+#   async def watch(registers):
+#       while True:
+#           events = await read_events(registers)
+#           ...
+
+import os
+import struct
+import asyncio
+
+import numpy
+
+
+def _fileno(source):
+    if isinstance(source, int):
+        return source
+    else:
+        return source.fileno()
+
+
+# Waits until the given file descriptor is readable
+async def wait_readable(fd):
+    loop = asyncio.get_event_loop()
+    ready = loop.create_future()
+
+    def on_ready():
+        if not ready.done():
+            ready.set_result(None)
+
+    loop.add_reader(fd, on_ready)
+    try:
+        await ready
+    finally:
+        loop.remove_reader(fd)
+
+
+# Asynchronous equivalent of RawRegisters.read_events(), waits for and returns
+# the next set of events.
+async def read_events(registers):
+    fd = _fileno(registers)
+    while True:
+        await wait_readable(fd)
+        try:
+            events = os.read(fd, 4)
+        except BlockingIOError:
+            # Someone else got there first, wait again
+            pass
+        else:
+            return struct.unpack('I', events)[0]
+
+
+# Asynchronous iterator over blocks of up to count bytes read from a DMA device
+# until end of file.  As for _Reader.read_blocks() the blocks are views into a
+# small ring of preallocated buffers, and are only valid until the ring wraps.
+# A short read which ends part way through an element is completed before the
+# block is returned, so every block holds whole elements.  Note that this reads
+# the file descriptor directly, bypassing any buffering in the reader.
+async def read_blocks(reader, count, dtype = None, buffers = 2):
+    fd = _fileno(reader)
+    dtype = numpy.dtype(numpy.uint8 if dtype is None else dtype)
+    ring = [
+        numpy.empty(count // dtype.itemsize, dtype = dtype)
+        for _ in range(buffers)]
+
+    n = 0
+    while True:
+        buffer = ring[n]
+        data = buffer.view(numpy.uint8)
+        length = 0
+        while length == 0 or length % dtype.itemsize:
+            await wait_readable(fd)
+            try:
+                read = os.readv(fd, [data[length:]])
+            except BlockingIOError:
+                continue
+            if read == 0:
+                break
+            length += read
+        if length == 0:
+            break
+        assert length % dtype.itemsize == 0, \
+            'Partial element at end of file'
+        n = (n + 1) % buffers
+        yield buffer[:length // dtype.itemsize]
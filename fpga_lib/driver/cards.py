@@ -0,0 +1,91 @@
+# Support for operating on a number of AMC cards in parallel
+#
+# A Cards instance opens all the cards matching a device name, and runs the same
+# operation across all cards concurrently on a thread pool, for example:
+#
+#   with Cards('amc525_lmbf') as cards:
+#       results, errors = cards.make_registers('SYS', None, 'registers.in')
+#       results, errors = cards.run(configure, settings)
+#
+# Results and errors are returned as dictionaries indexed by card prefix.
+
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .driver import RawRegisters, load_defines
+
+
+def discover_cards(name, dev_dir = '/dev'):
+    '''Returns a sorted list of device numbers for all cards with register
+    devices in dev_dir, ie for which <dev_dir>/<name>.<n>.reg exists.'''
+    pattern = re.compile(r'%s\.([0-9]+)\.reg$' % re.escape(name))
+    return sorted(
+        int(match.group(1))
+        for match in map(pattern.match, os.listdir(dev_dir))
+        if match)
+
+
+class Cards:
+    '''Opens all the given cards in parallel.  If prefixes is not specified
+    then all cards found by discover_cards() are opened.  The opener is called
+    as opener(name, prefix, dev_dir) to open each card, and defaults to
+    RawRegisters.  Cards which fail to open are recorded in .errors.'''
+
+    def __init__(self, name, prefixes = None, dev_dir = '/dev',
+            opener = RawRegisters, max_workers = None):
+        if prefixes is None:
+            prefixes = discover_cards(name, dev_dir)
+        self.name = name
+        self.__pool = ThreadPoolExecutor(max_workers or len(prefixes) or 1)
+        self.cards, self.errors = self.__map(
+            lambda prefix: opener(name, prefix, dev_dir), prefixes)
+
+    def __map(self, function, prefixes):
+        futures = [
+            (prefix, self.__pool.submit(function, prefix))
+            for prefix in prefixes]
+        results = OrderedDict()
+        errors = OrderedDict()
+        for prefix, future in futures:
+            try:
+                results[prefix] = future.result()
+            except Exception as e:
+                errors[prefix] = e
+        return (results, errors)
+
+    def run(self, function, *args, **kargs):
+        '''Calls function(card, *args, **kargs) for every open card in
+        parallel.  Returns a pair of dictionaries indexed by card prefix, the
+        first containing the results, the second any exceptions raised.'''
+        cards = self.cards
+        return self.__map(
+            lambda prefix: function(cards[prefix], *args, **kargs), cards)
+
+    def make_registers(self, name, range, *defines, cached = False):
+        '''Calls make_registers on every card, see RawRegisters, but with the
+        definitions only loaded once and shared by all cards.'''
+        groups, constants = load_defines(*defines)
+        def make(card):
+            card.add_registers(groups[name], range, cached)
+            return constants
+        return self.run(make)
+
+    def close(self):
+        self.__pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __iter__(self):
+        return iter(self.cards.values())
+
+    def __getitem__(self, prefix):
+        return self.cards[prefix]
@@ -9,6 +9,7 @@ import fcntl
 import select
 import struct
 import errno
+import time
 import numpy
 
 from .register_defines import load_register_defs
@@ -33,10 +34,10 @@ AMC_DMA_AREA_SIZE = AMC_IOCTL(4)
 
 # We want to support two ways to specify the device name: by sequence number, or
 # by PCI address (which encodes the backplane port).
-def device_name(name, part, prefix = 0):
+def device_name(name, part, prefix = 0, dev_dir = '/dev'):
     if isinstance(prefix, int):
         # Assume the prefix is just a device number identification
-        return '/dev/%s.%d.%s' % (name, prefix, part)
+        return '%s/%s.%d.%s' % (dev_dir, name, prefix, part)
     else:
         # Assume the prefix is a string.  The options are now:
         #  1. single character device number as above
@@ -44,23 +45,34 @@ def device_name(name, part, prefix = 0):
         #  3. full pci- address
         #  4. full device name
         if len(prefix) == 1:
-            return '/dev/%s.%s.%s' % (name, prefix, part)
+            return '%s/%s.%s.%s' % (dev_dir, name, prefix, part)
         elif len(prefix) == 2:
             # Prefix is the short form PCIe address
-            return '/dev/%s/pci-0000:%s:00.0/%s.%s' % (
-                name, prefix, name, part)
+            return '%s/%s/pci-0000:%s:00.0/%s.%s' % (
+                dev_dir, name, prefix, name, part)
         elif prefix.startswith('pci-'):
             # Prefix is long form PCIe address
-            return '/dev/%s/%s/%s.%s' % (name, prefix, name, part)
+            return '%s/%s/%s/%s.%s' % (dev_dir, name, prefix, name, part)
         else:
             # Assume prefix is complete device name
-            return '/dev/%s.%s' % (prefix, part)
+            return '%s/%s.%s' % (dev_dir, prefix, part)
+
+
+# Loads register definitions as for load_register_defs().  Special trick to
+# fall back to old filename if present, helps with loading registers during
+# development.
+def load_defines(*defines):
+    defines = [
+        name + '.old' if os.path.isfile(name + '.old') else name
+        for name in defines]
+    return load_register_defs(*defines)
 
 
 class RawRegisters:
-    def __init__(self, name, prefix):
+    def __init__(self, name, prefix, dev_dir = '/dev'):
         self.name = name
         self.prefix = prefix
+        self.dev_dir = dev_dir
 
         # Open register file and map into memory.
         self.reg_file = os.open(self.device_name('reg'), os.O_RDWR | os.O_SYNC)
@@ -72,22 +84,29 @@ class RawRegisters:
         if hasattr(self, 'reg_file'):
             os.close(self.reg_file)
 
-    def make_registers(self, name, range, *defines):
-        if range is None:
-            range = numpy.s_[:]
-        # Special trick to fall back to old filename if present, helps with
-        # loading registers during development
-        defines = [
-            name + '.old' if os.path.isfile(name + '.old') else name
-            for name in defines]
-        groups, constants = load_register_defs(*defines)
-        register_map = RegisterMap(self.regs[range], name)
-        setattr(self, name, groups[name](register_map))
+    # If cached is set the registers are created with a write cache, see
+    # register_defines.WriteCache, and writes must be flushed with _flush().
+    def make_registers(self, name, range, *defines, cached = False):
+        groups, constants = load_defines(*defines)
+        self.add_registers(groups[name], range, cached)
         return constants
 
+    # Creates registers for the top level group class top returned by
+    # load_register_defs(), so definitions can be loaded once and shared.
+    def add_registers(self, top, range, cached = False):
+        if range is None:
+            range = numpy.s_[:]
+        register_map = RegisterMap(self.regs[range], top._name)
+        setattr(self, top._name + '_map', register_map)
+        setattr(self, top._name, top(register_map, cached))
 
     def device_name(self, part):
-        return device_name(self.name, part, self.prefix)
+        return device_name(self.name, part, self.prefix, self.dev_dir)
+
+    def fileno(self):
+        '''Returns the register file descriptor, which becomes readable when
+        events are available.'''
+        return self.reg_file
 
     def read_events(self, wait = True, verbose = False):
         # If requested wait for device to become ready, otherwise fall through
@@ -130,18 +149,95 @@ class RegisterMap:
     def __init__(self, registers, name):
         self.registers = registers
         self.name = name
+        # Monitors notified of every register access, see the monitor module.
+        # Each monitor is called as monitor.register_access(offsets, is_write,
+        # elapsed) where elapsed is the access time in nanoseconds.
+        self.monitors = []
+
+    def __len__(self):
+        return len(self.registers)
 
     def _read_value(self, offset):
+        if self.monitors:
+            return self.__monitored_read(offset)
         value = self.registers[offset]
         if VERBOSE:
             print('%s[%03X] => %08X' % (self.name, offset, value))
         return value
 
     def _write_value(self, offset, value):
+        if self.monitors:
+            return self.__monitored_write(offset, value)
         if VERBOSE:
             print('%s[%03X] <= %08X' % (self.name, offset, value))
         self.registers[offset] = value
 
+    # Slow path versions of _read_value and _write_value when monitoring
+    def __monitored_read(self, offset):
+        start = time.perf_counter_ns()
+        value = self.registers[offset]
+        elapsed = time.perf_counter_ns() - start
+        if VERBOSE:
+            print('%s[%03X] => %08X' % (self.name, offset, value))
+        for monitor in self.monitors:
+            monitor.register_access((offset,), False, elapsed)
+        return value
+
+    def __monitored_write(self, offset, value):
+        if VERBOSE:
+            print('%s[%03X] <= %08X' % (self.name, offset, value))
+        start = time.perf_counter_ns()
+        self.registers[offset] = value
+        elapsed = time.perf_counter_ns() - start
+        for monitor in self.monitors:
+            monitor.register_access((offset,), True, elapsed)
+
+    # Returns functions for reading and writing the register at the given
+    # offset.  These are equivalent to calling _read_value and _write_value
+    # with offset, but avoid a method lookup on each call.
+    def _value_access(self, offset):
+        registers = self.registers
+        name = self.name
+        monitors = self.monitors
+
+        def read():
+            if monitors:
+                return self.__monitored_read(offset)
+            value = registers[offset]
+            if VERBOSE:
+                print('%s[%03X] => %08X' % (name, offset, value))
+            return value
+
+        def write(value):
+            if monitors:
+                return self.__monitored_write(offset, value)
+            if VERBOSE:
+                print('%s[%03X] <= %08X' % (name, offset, value))
+            registers[offset] = value
+
+        return (read, write)
+
+    # Returns a function for reading slices from the block of count registers
+    # at the given offset.  The result is a copy of the selected registers.
+    def _block_access(self, offset, count):
+        block = self.registers[offset:offset + count]
+        name = self.name
+        monitors = self.monitors
+
+        def read(index):
+            start = time.perf_counter_ns() if monitors else None
+            values = numpy.array(block[index], dtype = numpy.uint32)
+            if start is not None:
+                elapsed = time.perf_counter_ns() - start
+                offsets = range(offset, offset + count)[index]
+                for monitor in monitors:
+                    monitor.register_access(offsets, False, elapsed)
+            if VERBOSE:
+                print('%s[%03X:%03X] => [%d]' % (
+                    name, offset, offset + count, len(values)))
+            return values
+
+        return read
 
 
 # Wraps reading interface around a DMA device
@@ -156,6 +252,9 @@ class _Reader:
     def __exit__(self, *exc):
         self.close()
 
+    def fileno(self):
+        return self.__file.fileno()
+
     def size(self):
         '''Returns size of underlying area on FPGA'''
         return fcntl.ioctl(self.__file.fileno(), AMC_DMA_AREA_SIZE)
@@ -172,6 +271,65 @@ class _Reader:
         else:
             return numpy.frombuffer(buffer, dtype = self.__dtype)
 
+    def read_into(self, buffer):
+        '''Reads directly into the given contiguous array without allocating an
+        intermediate buffer.  Returns the number of array elements read, zero
+        at end of file.  A short read ending part way through an element is
+        completed before returning.'''
+        data = memoryview(buffer).cast('B')
+        count = 0
+        while count == 0 or count % buffer.itemsize:
+            read = self.__file.readinto(data[count:])
+            if not read:
+                break
+            count += read
+        assert count % buffer.itemsize == 0, 'Partial element at end of file'
+        return count // buffer.itemsize
+
+    def read_blocks(self, count = None, buffers = 2):
+        '''Returns an iterator over successive blocks of up to count bytes read
+        from the device, by default the optimal block size.  The blocks are
+        views into a ring of preallocated buffers and so are only valid until
+        the ring has wrapped round: copy blocks that need to be kept.'''
+        if count is None:
+            count = self.buf_size()
+        dtype = numpy.dtype(
+            numpy.uint8 if self.__dtype is None else self.__dtype)
+        ring = [
+            numpy.empty(count // dtype.itemsize, dtype = dtype)
+            for _ in range(buffers)]
+
+        n = 0
+        while True:
+            buffer = ring[n]
+            n = (n + 1) % buffers
+            length = self.read_into(buffer)
+            if length == 0:
+                break
+            yield buffer[:length]
+
+    def map(self, size = None):
+        '''Maps the DMA area into memory and returns it as a read only array of
+        the reader's dtype, allowing captured data to be examined in place
+        without copying.  By default the entire area is mapped.  For testing a
+        regular file can stand in for the device, in which case the default
+        size is the size of the file.'''
+        fileno = self.__file.fileno()
+        if size is None:
+            try:
+                size = self.size()
+            except (IOError, OSError) as e:
+                # Not a DMA device, assume that we've been given a file
+                if e.errno == errno.ENOTTY:
+                    size = os.fstat(fileno).st_size
+                else:
+                    raise
+        area = mmap.mmap(fileno, size, access = mmap.ACCESS_READ)
+        dtype = numpy.dtype(
+            numpy.uint8 if self.__dtype is None else self.__dtype)
+        return numpy.frombuffer(
+            area, dtype = dtype, count = size // dtype.itemsize)
+
     def seek(self, where):
         self.__file.seek(where)
 
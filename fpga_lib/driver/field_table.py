@@ -0,0 +1,80 @@
+# Vectorised decoding of captured register values into named fields
+#
+# A field table lists the position of every field of every readable register in
+# a top level register group, and can be used to decode an array of captured
+# register values into named field values in a single pass.  For example, given
+# an (N, regs) array of captured registers for the group TOP:
+#
+#   tables = load_field_tables('registers.in')
+#   fields = decode_fields(tables['TOP'], captured)
+#   fields['STATUS.READY']      # Array of N values of this field
+
+import numpy
+
+from fpga_lib import parse
+
+
+# Registers with these rw classes cannot be read back from hardware and so are
+# omitted from the field table.
+WRITE_ONLY = ('W', 'WP', 'WO', 'WM')
+
+
+# Returns a list of (name, offset, shift, width) entries for each field of each
+# readable register in the given top level group.  Registers without fields are
+# treated as a single 32-bit field.  Names are relative to the group.
+def group_fields(index, top):
+    prefix = len(top) + 1
+    fields = []
+    for register in index.registers(top):
+        if register.rw not in WRITE_ONLY:
+            register_fields = index.fields(register.name)
+            if register_fields:
+                fields.extend(
+                    (field.name[prefix:], field.offset) + field.field.range
+                    for field in register_fields)
+            else:
+                fields.append((register.name[prefix:], register.offset, 0, 32))
+    return fields
+
+
+# Returns a field table for the given top level group from a parse index.  The
+# table is a structured array with one row per field, with columns name, offset,
+# shift, and mask.  The offsets are relative to the start of the group.
+def field_table(index, top):
+    base, _ = index.groups[top].range
+    fields = group_fields(index, top)
+    name_length = max([len(name) for name, _, _, _ in fields] + [1])
+    return numpy.array([
+        (name, offset - base, shift, (1 << width) - 1)
+        for name, offset, shift, width in fields],
+        dtype = [
+            ('name', 'U%d' % name_length),
+            ('offset', numpy.uint32),
+            ('shift', numpy.uint32),
+            ('mask', numpy.uint32)])
+
+
+# Returns a dictionary of field tables for each top level group in a flattened
+# parse.
+def field_tables(defs):
+    index = parse.index.ParseIndex(defs)
+    return dict((top, field_table(index, top)) for top in index.groups)
+
+
+def load_field_tables(*defs_path):
+    return field_tables(parse.cached_defs(*defs_path, flatten = True))
+
+
+# Returns a structured dtype with a uint32 entry for each field in the table
+def field_dtype(table):
+    return numpy.dtype([(str(name), numpy.uint32) for name in table['name']])
+
+
+# Decodes an array of captured registers with shape (..., regs) into a
+# structured array with shape (...) and dtype field_dtype(table).  The result
+# can be indexed by field name to return an array of field values.
+def decode_fields(table, registers):
+    registers = numpy.asarray(registers, dtype = numpy.uint32)
+    values = numpy.ascontiguousarray(
+        (registers[..., table['offset']] >> table['shift']) & table['mask'])
+    return values.view(field_dtype(table)).reshape(values.shape[:-1])
@@ -0,0 +1,168 @@
+# Instrumentation of register access
+#
+# A Monitor attached to a RegisterMap counts reads and writes of every register
+# and samples the access latency into a histogram.  Field reads and writes can
+# also be counted.  When no monitor is attached the overhead is a single test
+# on each access.  For example:
+#
+#   registers.make_registers('SYS', None, 'registers.in')
+#   monitor = attach_monitor(registers.SYS_map, registers.SYS, fields = True)
+#   ...
+#   print(monitor.prometheus())
+#   detach_monitor(registers.SYS_map, monitor)
+
+from .register_defines import field_monitors, walk_registers
+
+
+# Latency histogram buckets are powers of two nanoseconds
+LATENCY_BUCKETS = 32
+
+
+class Monitor:
+    '''Gathers access statistics for a register map of the given size.  If a
+    Top instance is given register offsets are reported by name, and field
+    accesses to the registers of this Top can be counted.  Every monitored
+    access is timed by the register map, but only one in every sample timings
+    is added to the latency histograms.'''
+
+    def __init__(self, name, size, top = None, sample = 16):
+        self.name = name
+        self.size = size
+        self.sample = sample
+        self.__init_counts()
+
+        # Names of the registers at each offset and the names of each register
+        self.__names = {}
+        self.__registers = {}
+        if top is not None:
+            for name, register in walk_registers(top):
+                self.__names.setdefault(register._offset, []).append(name)
+                self.__registers[register] = name
+
+    def __init_counts(self):
+        self.reads = [0] * self.size
+        self.writes = [0] * self.size
+        # Field access counts indexed by field name, each a [reads, writes]
+        # pair of counts
+        self.fields = {}
+        # Read and write latency histograms and total sampled latency
+        self.latency = ([0] * LATENCY_BUCKETS, [0] * LATENCY_BUCKETS)
+        self.latency_sum = [0, 0]
+        self.__count = 0
+
+    def register_access(self, offsets, is_write, elapsed):
+        counts = self.writes if is_write else self.reads
+        for offset in offsets:
+            counts[offset] += 1
+
+        self.__count += 1
+        if self.__count >= self.sample:
+            self.__count = 0
+            bucket = min(elapsed.bit_length(), LATENCY_BUCKETS - 1)
+            self.latency[is_write][bucket] += 1
+            self.latency_sum[is_write] += elapsed
+
+    def field_access(self, register, name, is_write):
+        # Only count fields of our own registers
+        register_name = self.__registers.get(register)
+        if register_name is not None:
+            name = '%s.%s' % (register_name, name)
+            try:
+                counts = self.fields[name]
+            except KeyError:
+                counts = [0, 0]
+                self.fields[name] = counts
+            counts[is_write] += 1
+
+    def reset(self):
+        '''Resets all gathered statistics.'''
+        self.__init_counts()
+
+
+    def __register_name(self, offset):
+        return '|'.join(self.__names.get(offset, ['@%d' % offset]))
+
+    def __named_counts(self, counts):
+        return dict(
+            (self.__register_name(offset), count)
+            for offset, count in enumerate(counts)
+            if count)
+
+    def __histogram(self, is_write):
+        return dict(
+            (1 << bucket, count)
+            for bucket, count in enumerate(self.latency[is_write])
+            if count)
+
+    def summary(self):
+        '''Returns dictionary of gathered statistics.  Latency histograms are
+        dictionaries mapping bucket upper bound in nanoseconds to count.'''
+        return {
+            'reads' : self.__named_counts(self.reads),
+            'writes' : self.__named_counts(self.writes),
+            'fields' : dict(
+                (name, { 'reads' : reads, 'writes' : writes })
+                for name, (reads, writes) in self.fields.items()),
+            'latency' : {
+                'read' : self.__histogram(False),
+                'write' : self.__histogram(True), },
+        }
+
+    def prometheus(self, prefix = 'fpga_register'):
+        '''Returns gathered statistics formatted as Prometheus metrics.'''
+        lines = []
+        map_label = 'map="%s"' % self.name
+
+        for action, counts in [('reads', self.reads), ('writes', self.writes)]:
+            lines.append('# TYPE %s_%s_total counter' % (prefix, action))
+            lines.extend(
+                '%s_%s_total{%s,register="%s",offset="%d"} %d' % (
+                    prefix, action, map_label,
+                    self.__register_name(offset), offset, count)
+                for offset, count in enumerate(counts)
+                if count)
+
+        for is_write, action in enumerate(['reads', 'writes']):
+            lines.append('# TYPE %s_field_%s_total counter' % (prefix, action))
+            lines.extend(
+                '%s_field_%s_total{%s,field="%s"} %d' % (
+                    prefix, action, map_label, name, counts[is_write])
+                for name, counts in sorted(self.fields.items())
+                if counts[is_write])
+
+        for is_write, action in enumerate(['read', 'write']):
+            metric = '%s_%s_latency_ns' % (prefix, action)
+            lines.append('# TYPE %s histogram' % metric)
+            total = 0
+            for bucket, count in enumerate(self.latency[is_write]):
+                total += count
+                if count:
+                    lines.append('%s_bucket{%s,le="%d"} %d' % (
+                        metric, map_label, 1 << bucket, total))
+            lines.append(
+                '%s_bucket{%s,le="+Inf"} %d' % (metric, map_label, total))
+            lines.append('%s_sum{%s} %d' % (
+                metric, map_label, self.latency_sum[is_write]))
+            lines.append('%s_count{%s} %d' % (metric, map_label, total))
+
+        return '\n'.join(lines) + '\n'
+
+
+def attach_monitor(register_map, top = None, fields = False, sample = 16):
+    '''Creates and attaches a Monitor to the given register map, which must
+    support len() and implement the monitors list as for RegisterMap or
+    SimulatedMap.  If top is given it should
+    be the Top instance using register_map, and is used to name registers and
+    fields.  If fields is set field accesses are also counted.'''
+    monitor = Monitor(
+        register_map.name, len(register_map), top, sample)
+    register_map.monitors.append(monitor)
+    if fields:
+        field_monitors.append(monitor)
+    return monitor
+
+
+def detach_monitor(register_map, monitor):
+    register_map.monitors.remove(monitor)
+    if monitor in field_monitors:
+        field_monitors.remove(monitor)
@@ -5,29 +5,47 @@ import numpy
 from fpga_lib import parse
 
 
+# List of monitors to be notified of every field access, see the monitor module.
+# Each monitor is called as monitor.field_access(register, name, is_write).
+field_monitors = []
+
+
 # Reads and writes a bit-field in a register
 class Field:
     def __init__(self, field):
         self._name = field.name
         self._range = field.range
 
-    def _read(self, parent):
-        offset, length = self._range
-        mask = (1 << length) - 1
+        # Precompute the field geometry for the accessors
+        self._shift, length = field.range
+        self._mask = (1 << length) - 1
+
+    # Returns specialised read and write functions for this field with the
+    # field geometry bound in.  A field read is then a single register read
+    # followed by a shift and mask, a field write is a masked register update.
+    def _accessors(self):
+        name = self._name
+        shift = self._shift
+        mask = self._mask
+        field_mask = mask << shift
 
-        reg = parent._read_value()
-        return (reg >> offset) & mask
+        monitors = field_monitors
 
-    def _write(self, parent, value):
-        offset, length = self._range
-        mask = (1 << length) - 1
+        def read(register):
+            if monitors:
+                for monitor in monitors:
+                    monitor.field_access(register, name, False)
+            return (register._read_value() >> shift) & mask
 
-        assert value == value & mask, \
-            'Cannot write %d to field %s' % (value, self._name)
-        mask = mask << offset
+        def write(register, value):
+            assert value == value & mask, \
+                'Cannot write %d to field %s' % (value, name)
+            if monitors:
+                for monitor in monitors:
+                    monitor.field_access(register, name, True)
+            register._update_value(value << shift, field_mask)
 
-        reg = parent._read_value()
-        parent._write_value((value << offset) | (reg & ~mask))
+        return (read, write)
 
 
 # Dummy storage for register without hardware.
@@ -35,11 +53,22 @@ class DummyBase:
     def __init__(self, value):
         self.value = value
 
-    def _read_value(self, offset, rw):
-        return self.value
+    def _register_access(self, offset, rw):
+        def read():
+            return self.value
+        def write(value):
+            self.value = value
+        return (read, write, _make_update(read, write))
 
-    def _write_value(self, offset, rw, value):
-        self.value = value
+
+# Returns an update function for the given read and write functions.  The update
+# function performs a read-modify-write of the bits selected by mask.
+def _make_update(read, write):
+    def update(value, mask):
+        # Note that the mask must be inverted as a positive 32-bit value so
+        # that it can be safely combined with numpy.uint32 register values.
+        write(value | (read() & (0xFFFFFFFF & ~mask)))
+    return update
 
 
 # Computes a register class from the given register parse and fields
@@ -52,26 +81,36 @@ def make_register(register, fields):
         # This is a dictionary of field accessor methods indexed by field name.
         # We would use property attributes, but they don't play well with
         # __setattr__, in particular we can't block assignment to non-existent
-        # fields.
+        # fields.  Reads are served by read-only properties installed below.
         __fields = {}
 
-        def __init__(self, parent):
-            self.__dict__['_Register__parent'] = parent
+        # The offset can be overridden for register array elements, which all
+        # share the same class.
+        def __init__(self, parent, offset = None):
+            if offset is None:
+                offset = self.__offset
+            # Resolve the register access functions once from our parent.  The
+            # resulting _read_value, _write_value and _update_value functions
+            # go directly to the underlying storage without walking back up the
+            # parent chain.
+            read, write, update = \
+                parent._register_access(offset, self.__rw)
+            self.__dict__.update({
+                '_Register__parent' : parent,
+                '_Register__offset' : offset,
+                '_read_value' : read,
+                '_write_value' : write,
+                '_update_value' : update, })
 
         def __getattr__(self, name):
+            # Only called for names not found as attributes: all fields are
+            # handled by the properties installed on the class.
             try:
-                read, write = self.__fields[name]
-            except KeyError:
-                try:
-                    # If no support in fields, look for this in the dictionary
-                    return self.__dict__[name]
-                except KeyError as e:
-                    # Suppress the confusing nested exception message that would
-                    # otherwise occur here.
-                    raise e from None
-            else:
-                # Delegate named fields to their associated read method
-                return read(self)
+                return self.__dict__[name]
+            except KeyError as e:
+                # Suppress the confusing nested exception message that would
+                # otherwise occur here.
+                raise e from None
 
         def __setattr__(self, name, value):
             # Only allow existing fields to be updated
@@ -79,11 +118,15 @@ def make_register(register, fields):
             write(self, value)
 
 
-        def _read_value(self):
-            return self.__parent._read_value(self.__offset, self.__rw)
+        @property
+        def _offset(self):
+            return self.__offset
+
+        def __get_value(self):
+            return self._read_value()
 
-        def _write_value(self, value):
-            self.__parent._write_value(self.__offset, self.__rw, value)
+        def __put_value(self, value):
+            self._write_value(value)
 
 
         def _get_fields(self, read = True):
@@ -112,27 +155,26 @@ def make_register(register, fields):
         def _write_fields_rw(self, **fields):
             self.__write_fields(True, fields)
 
-        @classmethod
-        def _writer(cls, parent, value):
-            register = cls(parent)
+        # Assigns either a register value or a set of fields to this register
+        def _assign(self, value):
             if isinstance(value, (int, numpy.integer)):
-                register._write_value(value)
+                self._write_value(value)
             elif isinstance(value, Register):
-                register.__set_fields(value)
+                self.__set_fields(value)
             else:
                 assert False
 
         # Populate all the fields including the two special fields
         #
         # _value returns the underlying register value
-        __fields['_value'] = (_read_value, _write_value)
+        __fields['_value'] = (__get_value, __put_value)
         # _fields returns an updatable image of the current register settings as
         # a group of settable fields
         __fields['_fields'] = (_get_fields, __set_fields)
         # Populate the rest of the fields and remember the field names
         _field_names = []
         for field in fields:
-            __fields[field._name] = (field._read, field._write)
+            __fields[field._name] = field._accessors()
             _field_names.append(field._name)
 
 
@@ -146,12 +188,20 @@ def make_register(register, fields):
                 values = '%d' % self._value
             return '<Reg %s @%d %s>' % (self._name, self.__offset, values)
 
+    # Install the field readers as properties so that reading a field doesn't
+    # need to go through __getattr__.
+    for name, (read, write) in Register._Register__fields.items():
+        setattr(Register, name, property(read))
+
     return Register
 
 
 class Delegator(object):
+    _attributes = ()
+
     def __init__(self, parent):
         self.__dict__['_Delegator__parent'] = parent
+        make_attributes(self)
 
     def _read_value(self, offset, rw):
         return self.__parent._read_value(offset, rw)
@@ -159,6 +209,21 @@ class Delegator(object):
     def _write_value(self, offset, rw, value):
         self.__parent._write_value(offset, rw, value)
 
+    def _register_access(self, offset, rw):
+        return self.__parent._register_access(offset, rw)
+
+    def _block_access(self, offset, count, rw):
+        return self.__parent._block_access(offset, count, rw)
+
+    def _capture(self, offset, count):
+        return self.__parent._capture(offset, count)
+
+    # Returns a snapshot of this group: all registers in the group are read in
+    # a single block read, and the returned object presents the same register
+    # and field interface as this group, but decoded from the captured values.
+    def _snapshot(self):
+        return self.__class__(self.__parent._capture(*self._range))
+
     @classmethod
     def _inject_methods(cls, **methods):
         for name, method in methods.items():
@@ -169,43 +234,125 @@ class Delegator(object):
         assert False, 'Cannot assign to field %s' % name
 
 
+# Vectorised access to a single field across the elements of a register array.
+# Indexing with a slice returns an array of field values.
+class ArrayField:
+    def __init__(self, array, field):
+        self.__array = array
+        self.__name = field._name
+        self.__shift = field._shift
+        self.__mask = field._mask
+
+    def __len__(self):
+        return len(self.__array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return (self.__array[index] >> self.__shift) & self.__mask
+        else:
+            return getattr(self.__array[index], self.__name)
+
+    def __repr__(self):
+        return '<ArrayField %s.%s>' % (self.__array._name, self.__name)
+
+
 def make_array(array, fields):
+    # All elements of the array share the same register class, only the offset
+    # differs.
+    element = make_register(
+        parse.register_defines.Register(
+            array.name, array.range[0], array.rw, fields, None, []),
+        fields)
+
     class RegisterArray(Delegator):
         _name = array.name
-        __range = array.range
+        _range = array.range
         __rw = array.rw
 
+        def __init__(self, parent):
+            Delegator.__init__(self, parent)
+            base, length = self._range
+            self.__dict__.update({
+                '_RegisterArray__read' :
+                    self._block_access(base, length, self.__rw),
+                '_RegisterArray__elements' : [None] * length, })
+            for field in fields:
+                self.__dict__[field._name] = ArrayField(self, field)
+
+        def __len__(self):
+            return self._range[1]
+
+        # Indexing with an integer returns the register at that index, indexing
+        # with a slice returns an array of raw register values.
         def __getitem__(self, index):
-            base, length = self.__range
+            if isinstance(index, slice):
+                return self.__read(index)
+
+            base, length = self._range
             if not 0 <= index < length:
                 raise IndexError()
 
-            # Build a temporary register to wrap this entry
-            register = parse.register_defines.Register(
-                self._name, base + index, self.__rw, fields, None, [])
-            return make_register(register, fields)(self)
+            register = self.__elements[index]
+            if register is None:
+                register = element(self, base + index)
+                self.__elements[index] = register
+            return register
+
+        # Returns the raw values of all registers in the array
+        def _read_all(self):
+            return self.__read(slice(None))
 
         def __repr__(self):
-            base, length = self.__range
+            base, length = self._range
             return '<RegArray %s @%d [%d]>' % (self._name, base, length)
 
     return RegisterArray
 
 
-def add_attributes(target, attributes):
-    for attribute in attributes:
-        if isinstance(attribute, list):
-            # When we parsed an overlay we were returned a list of attributes
-            add_attributes(target, attribute)
+# Iterates over all the registers in the given Top or group instance returning
+# (name, register) pairs, where name is the full dotted name of the register.
+def walk_registers(group, prefix = ''):
+    for name, attribute in group._attributes:
+        child = group.__dict__[name]
+        name = prefix + name
+        if isinstance(child, Delegator) and hasattr(child, '__getitem__'):
+            # Register array
+            for n in range(len(child)):
+                yield ('%s[%d]' % (name, n), child[n])
+        elif isinstance(child, Delegator):
+            for entry in walk_registers(child, name + '.'):
+                yield entry
         else:
-            setattr(target, attribute._name,
-                property(attribute, getattr(attribute, '_writer', None)))
+            yield (name, child)
+
+
+# Records the attribute classes to be instantiated for each instance of target.
+# The attributes are created once by make_attributes() below when the group is
+# instantiated, so that repeated access returns the same cached object.
+def add_attributes(target, attributes):
+    def gather(attributes):
+        for attribute in attributes:
+            if isinstance(attribute, list):
+                # When we parsed an overlay we were returned a list of
+                # attributes
+                yield from gather(attribute)
+            else:
+                yield (attribute._name, attribute)
+    target._attributes = tuple(target._attributes) + tuple(gather(attributes))
+
+
+# Populates the given group instance with its attributes.  Each register will
+# resolve its access functions through the group at this point.
+def make_attributes(group):
+    for name, attribute in group._attributes:
+        group.__dict__[name] = attribute(group)
 
 
 # An ordinary group just delegates its attributes
-def make_group(group, attributes):
+def make_group(group, attributes, range = None):
     class Group(Delegator):
         _name = group.name
+        _range = group.range if range is None else range
 
         def __repr__(self):
             return '<Group %s: %s>' % (
@@ -217,31 +364,458 @@ def make_group(group, attributes):
     return Group
 
 
+# Hardware interface for register snapshots: presents the registers captured
+# from offset onwards as a read-only register map.
+class SnapshotMap:
+    def __init__(self, registers, offset, name):
+        self.registers = registers
+        self.offset = offset
+        self.name = name
+
+    def __index(self, offset):
+        index = offset - self.offset
+        if not 0 <= index < len(self.registers):
+            raise IndexError('Register %d not in snapshot' % offset)
+        return index
+
+    def _read_value(self, offset):
+        return self.registers[self.__index(offset)]
+
+    def _write_value(self, offset, value):
+        assert False, 'Cannot write to register snapshot'
+
+    def _value_access(self, offset):
+        registers = self.registers
+        index = self.__index(offset)
+
+        def read():
+            return registers[index]
+
+        def write(value):
+            assert False, 'Cannot write to register snapshot'
+
+        return (read, write)
+
+    def _block_access(self, offset, count):
+        block = self.registers[self.__index(offset):][:count]
+
+        def read(index):
+            return block[index].copy()
+
+        return read
+
+
+# Returns a function for reading a slice from the block of count registers
+# starting at offset, falling back to reading one register at a time if the
+# hardware doesn't support block access.
+def _block_access(hardware, offset, count):
+    try:
+        block_access = hardware._block_access
+    except AttributeError:
+        def read(index):
+            return numpy.array([
+                hardware._read_value(offset + n)
+                for n in range(count)[index]], dtype = numpy.uint32)
+        return read
+    else:
+        return block_access(offset, count)
+
+
+# Returns a function for reading slices of count registers which always read as
+# zero.
+def _zeros_access(count):
+    def read(index):
+        return numpy.zeros(len(range(count)[index]), dtype = numpy.uint32)
+    return read
+
+
+# A transaction buffers register writes until it is committed, when each
+# updated register is written exactly once in address order.  Registers where
+# only some fields have been written are read once at this point to complete the
+# update.  Transactions are created by calling Top._transaction() and are used as
+# context managers, for example:
+#
+#   with top._transaction():
+#       top.CONTROL.ENABLE = 1
+#       top.CONTROL.MODE = 2
+#       top.GROUP.CONFIG = 0
+#
+# Reads made through the Top while a transaction is active see the buffered
+# writes merged over the hardware value, so read-modify-write updates within a
+# transaction build on earlier updates.  Transactions don't nest: a nested
+# transaction joins the enclosing one.  If the body raises an exception the
+# buffered writes are discarded.
+class Transaction:
+    def __init__(self, active, read_value, write_value):
+        self.__active = active
+        self.__read_value = read_value
+        self.__write_value = write_value
+        self.__nested = False
+        # Dictionary of pending updates indexed by offset, each entry records
+        # the register rw, the updated bits, and the mask of updated bits.
+        self.__updates = {}
+
+    def __enter__(self):
+        if self.__active:
+            self.__nested = True
+        else:
+            self.__active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.__nested:
+            del self.__active[:]
+            if exc_type is None:
+                self.commit()
+            else:
+                self.abort()
+
+    def _write_value(self, offset, rw, value):
+        self._update_value(offset, rw, value, 0xFFFFFFFF)
+
+    def _update_value(self, offset, rw, value, mask):
+        assert rw != 'R', 'Writing to read only register'
+        try:
+            update = self.__updates[offset]
+        except KeyError:
+            self.__updates[offset] = [rw, value, mask]
+        else:
+            update[0] = rw
+            update[1] = value | (update[1] & (0xFFFFFFFF & ~mask))
+            update[2] |= mask
+
+    # Returns the value of the register at offset with any buffered update
+    # merged in, calling read to fetch the bits not yet written.
+    def _read_value(self, offset, read):
+        try:
+            rw, value, mask = self.__updates[offset]
+        except KeyError:
+            return read()
+        if mask != 0xFFFFFFFF:
+            value |= read() & (0xFFFFFFFF & ~mask)
+        return value
+
+    # Writes all buffered updates
+    def commit(self):
+        updates = self.__updates
+        self.__updates = {}
+        for offset in sorted(updates):
+            rw, value, mask = updates[offset]
+            if mask != 0xFFFFFFFF:
+                value |= \
+                    self.__read_value(offset, rw) & (0xFFFFFFFF & ~mask)
+            self.__write_value(offset, rw, value)
+
+    # Discards all buffered updates
+    def abort(self):
+        self.__updates = {}
+
+
+# Returns read and write functions for the given hardware offset, falling back
+# to the hardware _read_value and _write_value methods if the hardware doesn't
+# provide specialised accessors.
+def _value_access(hardware, offset):
+    try:
+        value_access = hardware._value_access
+    except AttributeError:
+        def read():
+            return hardware._read_value(offset)
+        def write(value):
+            hardware._write_value(offset, value)
+        return (read, write)
+    else:
+        return value_access(offset)
+
+
+# Registers with these rw classes are cached by a write cache
+CACHED_RW = ('RMW', 'WM')
+
+
+# A write cache holds a shadow copy of configuration registers, those with rw
+# class in CACHED_RW.  Writes update the shadow and are only written to hardware
+# when flushed, and then only if the value differs from that last written.
+# Reads are served from the shadow where possible.
+class WriteCache:
+    def __init__(self, hardware):
+        self.__hardware = hardware
+        self.__shadow = {}      # Current value of each register
+        self.__written = {}     # Value known to be in hardware
+        self.__dirty = set()    # Registers to be written on flush
+
+    def read(self, offset, rw):
+        try:
+            return self.__shadow[offset]
+        except KeyError:
+            value = self.__hardware._read_value(offset)
+            if rw == 'RMW':
+                # Only RMW registers can be trusted to read back what was last
+                # written, so only these are cached on read.
+                self.__shadow[offset] = value
+                self.__written[offset] = value
+            return value
+
+    def write(self, offset, value):
+        self.__shadow[offset] = value
+        if offset in self.__written and self.__written[offset] == value:
+            self.__dirty.discard(offset)
+        else:
+            self.__dirty.add(offset)
+
+    # Updates values read from hardware at the given offsets with any values
+    # held in the shadow.
+    def overlay(self, offsets, values):
+        shadow = self.__shadow
+        for n, offset in enumerate(offsets):
+            if offset in shadow:
+                values[n] = shadow[offset]
+        return values
+
+    def flush(self):
+        for offset in sorted(self.__dirty):
+            value = self.__shadow[offset]
+            self.__hardware._write_value(offset, value)
+            self.__written[offset] = value
+        self.__dirty.clear()
+
+    def invalidate(self):
+        self.__shadow.clear()
+        self.__written.clear()
+        self.__dirty.clear()
+
+    # Returns a read only copy of the cache for a capture of hardware.
+    def capture(self, hardware):
+        return CapturedCache(hardware, dict(self.__shadow))
+
+
+# Read only copy of a write cache used by register captures.  Registers not held
+# in the cache are read from the capture, except for WM registers which cannot be
+# read back and so read as zero.
+class CapturedCache:
+    def __init__(self, hardware, shadow):
+        self.__hardware = hardware
+        self.__shadow = shadow
+
+    def read(self, offset, rw):
+        try:
+            return self.__shadow[offset]
+        except KeyError:
+            if rw == 'WM':
+                return 0
+            else:
+                return self.__hardware._read_value(offset)
+
+    def write(self, offset, value):
+        assert False, 'Cannot write to register snapshot'
+
+    def overlay(self, offsets, values):
+        shadow = self.__shadow
+        for n, offset in enumerate(offsets):
+            if offset in shadow:
+                values[n] = shadow[offset]
+        return values
+
+
 def make_top(group, attributes):
     class Top:
         _name = group.name
-
-        def __init__(self, hardware):
+        _range = group.range
+        # Parsed definition, used to build simulated register maps
+        _group = group
+        _attributes = ()
+
+        # If cached is set then writes to RMW and WM registers are cached
+        # until _flush() is called, see WriteCache.
+        def __init__(self, hardware, cached = False):
+            self.__setup(hardware, {})
+            if cached:
+                self.__cache = WriteCache(hardware)
+            make_attributes(self)
+
+        def __setup(self, hardware, values, unreadable = ()):
             self.__hardware = hardware
             # Cached values for write only registers
-            self.__values = {}
+            self.__values = values
+            # Register rw classes which read as zero, used by captures
+            self.__unreadable = unreadable
+            # Holds the active transaction, if any
+            self.__transaction = []
+            # Write cache if enabled
+            self.__cache = None
+
+        def __setattr__(self, name, value):
+            if name in self._attribute_names:
+                # Assignment to a register is passed through to the register,
+                # other attributes cannot be assigned.
+                try:
+                    assign = self.__dict__[name]._assign
+                except AttributeError:
+                    raise AttributeError(
+                        'Cannot assign to %s' % name) from None
+                assign(value)
+            else:
+                self.__dict__[name] = value
 
         def _read_value(self, offset, rw):
+            if self.__transaction:
+                return self.__transaction[0]._read_value(
+                    offset, lambda: self.__read_value(offset, rw))
+            else:
+                return self.__read_value(offset, rw)
+
+        def __read_value(self, offset, rw):
             if rw == 'W':
                 # Write only register, return cached value
                 return self.__values.get(offset, 0)
             elif rw == 'WP':
                 # Pulse register, only ever reads as zero
                 return 0
+            elif self.__cache and rw in CACHED_RW:
+                return self.__cache.read(offset, rw)
+            elif rw in self.__unreadable:
+                return 0
             else:
                 return self.__hardware._read_value(offset)
 
         def _write_value(self, offset, rw, value):
+            if self.__transaction:
+                self.__transaction[0]._write_value(offset, rw, value)
+            else:
+                self.__write_value(offset, rw, value)
+
+        def __write_value(self, offset, rw, value):
             assert rw != 'R', 'Writing to read only register'
             if rw == 'W':
                 # Cache value written to write-only register
                 self.__values[offset] = value
-            self.__hardware._write_value(offset, value)
+            if self.__cache and rw in CACHED_RW:
+                self.__cache.write(offset, value)
+            else:
+                self.__hardware._write_value(offset, value)
+
+        # Writes all changed registers held in the write cache to hardware in
+        # address order.
+        def _flush(self):
+            if self.__cache:
+                self.__cache.flush()
+
+        # Discards the contents of the write cache, including any unflushed
+        # writes, so that registers are next read from hardware.
+        def _invalidate(self):
+            if self.__cache:
+                self.__cache.invalidate()
+
+        # Returns a context manager for a transaction: all register writes
+        # made through this Top are buffered until the transaction completes.
+        def _transaction(self):
+            return Transaction(
+                self.__transaction, self.__read_value, self.__write_value)
+
+        # Returns specialised read and write functions for the register at the
+        # given offset implementing the same rules as _read_value and
+        # _write_value above.
+        def _register_access(self, offset, rw):
+            hw_read, hw_write = _value_access(self.__hardware, offset)
+            values = self.__values
+            cache = self.__cache
+            if cache and rw in CACHED_RW:
+                def hw_read():
+                    return cache.read(offset, rw)
+                def hw_write(value):
+                    cache.write(offset, value)
+            elif rw in self.__unreadable:
+                def hw_read():
+                    return 0
+
+            if rw == 'W':
+                def read():
+                    return values.get(offset, 0)
+            elif rw == 'WP':
+                def read():
+                    return 0
+            else:
+                read = hw_read
+
+            if rw == 'R':
+                def write_value(value):
+                    assert False, 'Writing to read only register'
+            elif rw == 'W':
+                def write_value(value):
+                    values[offset] = value
+                    hw_write(value)
+            else:
+                write_value = hw_write
+            update_value = _make_update(read, write_value)
+
+            # Writes are diverted to the active transaction if there is one,
+            # and reads see any writes it holds.  Read only registers can't
+            # have buffered writes, so their reads are left as they are.
+            transaction = self.__transaction
+            if rw != 'R':
+                value_read = read
+                def read():
+                    if transaction:
+                        return transaction[0]._read_value(offset, value_read)
+                    else:
+                        return value_read()
+            def write(value):
+                if transaction:
+                    transaction[0]._update_value(offset, rw, value, 0xFFFFFFFF)
+                else:
+                    write_value(value)
+            def update(value, mask):
+                if transaction:
+                    transaction[0]._update_value(offset, rw, value, mask)
+                else:
+                    update_value(value, mask)
+
+            return (read, write, update)
+
+        # Returns a function for reading slices of the register array of
+        # count registers at offset, again following the rules above.
+        def _block_access(self, offset, count, rw):
+            if rw == 'W':
+                values = self.__values
+                def read(index):
+                    return numpy.array([
+                        values.get(offset + n, 0)
+                        for n in range(count)[index]], dtype = numpy.uint32)
+                return read
+            elif rw == 'WP' or rw in self.__unreadable:
+                return _zeros_access(count)
+            elif self.__cache and rw in CACHED_RW:
+                if rw in self.__unreadable:
+                    hw_read = _zeros_access(count)
+                else:
+                    hw_read = _block_access(self.__hardware, offset, count)
+                cache = self.__cache
+                def read(index):
+                    return cache.overlay(
+                        range(offset, offset + count)[index], hw_read(index))
+                return read
+            else:
+                return _block_access(self.__hardware, offset, count)
+
+        # Returns a Top without attributes which reads the given range of
+        # registers from a single block read of the hardware.  WO and WM
+        # registers cannot be read back and read as zero, except that, as for
+        # live reads, registers held in the write cache are read from a copy
+        # of the cache.
+        def _capture(self, offset, count):
+            registers = _block_access(self.__hardware, offset, count)(
+                slice(None))
+            snapshot_map = SnapshotMap(registers, offset, self._name)
+            capture = self.__class__.__new__(self.__class__)
+            capture.__setup(
+                snapshot_map, dict(self.__values), ('WO', 'WM'))
+            if self.__cache:
+                capture.__cache = self.__cache.capture(snapshot_map)
+            return capture
+
+        # Returns a snapshot of all registers, see Delegator._snapshot.
+        def _snapshot(self):
+            snapshot = self._capture(*self._range)
+            make_attributes(snapshot)
+            return snapshot
 
         def __repr__(self):
             return '<Top %s: %s>' % (
@@ -249,6 +823,7 @@ def make_top(group, attributes):
                 ', '.join(field for field in dir(self) if field[0] != '_'))
 
     add_attributes(Top, attributes)
+    Top._attribute_names = frozenset(name for name, _ in Top._attributes)
 
     return Top
 
@@ -282,7 +857,7 @@ class GenerateMethods(parse.register_defines.WalkParse):
             self.walk_register(
                 context, register._replace(offset = overlay.offset))
             for register in overlay.registers]
-        return make_group(overlay, registers)
+        return make_group(overlay, registers, (overlay.offset, 1))
 
     def walk_union(self, context, union):
         return self.walk_subgroups(context, union)
@@ -296,8 +871,12 @@ generate = GenerateMethods()
 
 def load_register_defs(*defs_path):
     # Read the definitions in parsed form
-    defs = parse.parsed_defs(*defs_path, flatten = True)
+    defs = parse.cached_defs(*defs_path, flatten = True)
+    return make_register_defs(defs)
+
 
+# Generates group classes and constants from a flattened parse
+def make_register_defs(defs):
     groups = {}
     for group in defs.groups:
         groups[group.name] = generate.walk_top(group)
@@ -0,0 +1,245 @@
+# Simulated register hardware for testing without a card
+#
+# SimulatedRegisters presents the same interface as RawRegisters, but each
+# register group is backed by a SimulatedMap sized from the register
+# definitions.  A SimulatedMap has separate read and write register banks and
+# honours the register rw classes:
+#
+#   R, R+W, R+WM    Reads return the read bank, writes only go to the write bank
+#   RMW             Reads return the last value written
+#   WO, WM          Reads return zero
+#
+# Hardware behaviour is modelled by updating read_bank directly, or by attaching
+# a behaviour model to a register offset with set_model().  For example:
+#
+#   sim = SimulatedRegisters('amc525_lmbf')
+#   sim.make_registers('SYS', None, 'registers.in')
+#   sim.SYS_map.read_bank[0] = 0x0102       # Set version register
+#   sim.SYS_map.set_model(4, ClearOnRead()) # Event register
+
+import time
+
+import numpy
+
+from fpga_lib import parse
+
+from .driver import device_name, load_defines
+
+
+# Sources of register reads
+READ_ZERO = 0
+READ_BANK = 1
+READ_WRITTEN = 2
+
+READ_MODES = {
+    'R' : READ_BANK,
+    'R+W' : READ_BANK,
+    'R+WM' : READ_BANK,
+    'RMW' : READ_WRITTEN,
+    'WO' : READ_ZERO,
+    'WM' : READ_ZERO,
+}
+
+
+# Walks a flattened register group marking the read mode of each register.  If
+# more than one register occupies an offset, as for *RW pairs, the readable
+# register takes priority.  The context is the array of modes.
+class MarkModes(parse.register_defines.WalkParse):
+    def __init__(self, base):
+        self.base = base
+
+    def __mark(self, modes, offset, count, rw):
+        block = modes[offset - self.base:][:count]
+        numpy.maximum(block, READ_MODES[rw], out = block)
+
+    def walk_field(self, modes, field):
+        pass
+
+    def walk_register(self, modes, register):
+        self.__mark(modes, register.offset, 1, register.rw)
+
+    def walk_register_array(self, modes, array):
+        self.__mark(modes, array.range[0], array.range[1], array.rw)
+
+    def walk_group(self, modes, group):
+        self.walk_subgroups(modes, group)
+
+    def walk_rw_pair(self, modes, rw_pair):
+        for register in rw_pair.registers:
+            self.walk_register(modes, register)
+
+    def walk_overlay(self, modes, overlay):
+        self.__mark(modes, overlay.offset, 1, overlay.rw)
+
+    def walk_union(self, modes, union):
+        self.walk_subgroups(modes, union)
+
+
+# Returns array of read modes for each register in a flattened top level group.
+def register_modes(group):
+    base, length = group.range
+    modes = numpy.zeros(length, dtype = numpy.uint8)
+    MarkModes(base).walk_group(modes, group)
+    return modes
+
+
+# Behaviour models can be attached to individual registers to override the
+# default behaviour.  The default model implements the standard behaviour.
+class Model:
+    def read(self, sim, offset):
+        mode = sim.modes[offset]
+        if mode == READ_BANK:
+            return sim.read_bank[offset]
+        elif mode == READ_WRITTEN:
+            return sim.write_bank[offset]
+        else:
+            return numpy.uint32(0)
+
+    def write(self, sim, offset, value):
+        sim.write_bank[offset] = value
+
+
+# Counter which increments on each read, writing sets the counter
+class Counter(Model):
+    def read(self, sim, offset):
+        value = sim.read_bank[offset]
+        sim.read_bank[offset] = (int(value) + 1) & 0xFFFFFFFF
+        return value
+
+    def write(self, sim, offset, value):
+        sim.read_bank[offset] = value
+        sim.write_bank[offset] = value
+
+
+# Event register which is cleared on read
+class ClearOnRead(Model):
+    def read(self, sim, offset):
+        value = sim.read_bank[offset]
+        sim.read_bank[offset] = 0
+        return value
+
+
+# Notifies monitors of an access to offsets which started at start
+def _notify(monitors, offsets, is_write, start):
+    elapsed = time.perf_counter_ns() - start
+    for monitor in monitors:
+        monitor.register_access(offsets, is_write, elapsed)
+
+
+# Simulated register map implementing the RegisterMap hardware interface
+class SimulatedMap:
+    def __init__(self, name, modes):
+        self.name = name
+        self.modes = modes
+        self.read_bank = numpy.zeros(len(modes), dtype = numpy.uint32)
+        self.write_bank = numpy.zeros(len(modes), dtype = numpy.uint32)
+        self.__models = [None] * len(modes)
+        self.__has_model = numpy.zeros(len(modes), dtype = bool)
+        # Monitors notified of every register access, as for RegisterMap
+        self.monitors = []
+
+    def __len__(self):
+        return len(self.modes)
+
+    def set_model(self, offset, model):
+        '''Attaches a behaviour model to the given register offset, or removes
+        any existing model if model is None.'''
+        self.__models[offset] = model
+        self.__has_model[offset] = model is not None
+
+    def _read_value(self, offset):
+        return self._value_access(offset)[0]()
+
+    def _write_value(self, offset, value):
+        self._value_access(offset)[1](value)
+
+    def _value_access(self, offset):
+        models = self.__models
+        monitors = self.monitors
+        write_bank = self.write_bank
+        mode = self.modes[offset]
+        if mode == READ_BANK:
+            bank, index = self.read_bank, offset
+        elif mode == READ_WRITTEN:
+            bank, index = self.write_bank, offset
+        else:
+            bank, index = numpy.zeros(1, dtype = numpy.uint32), 0
+
+        def read():
+            start = time.perf_counter_ns() if monitors else None
+            model = models[offset]
+            if model is None:
+                value = bank[index]
+            else:
+                value = model.read(self, offset)
+            if start is not None:
+                _notify(monitors, (offset,), False, start)
+            return value
+
+        def write(value):
+            start = time.perf_counter_ns() if monitors else None
+            model = models[offset]
+            if model is None:
+                write_bank[offset] = value
+            else:
+                model.write(self, offset, value)
+            if start is not None:
+                _notify(monitors, (offset,), True, start)
+
+        return (read, write)
+
+    def _block_access(self, offset, count):
+        monitors = self.monitors
+
+        def read(index):
+            start = time.perf_counter_ns() if monitors else None
+            offsets = numpy.arange(offset, offset + count)[index]
+            modes = self.modes[offsets]
+            values = numpy.where(
+                modes == READ_BANK, self.read_bank[offsets],
+                numpy.where(
+                    modes == READ_WRITTEN, self.write_bank[offsets], 0)
+            ).astype(numpy.uint32)
+            for n in numpy.flatnonzero(self.__has_model[offsets]):
+                values[n] = self.__models[offsets[n]].read(self, offsets[n])
+            if start is not None:
+                _notify(monitors, offsets, False, start)
+            return values
+
+        return read
+
+
+class SimulatedRegisters:
+    '''Simulated replacement for RawRegisters.  Each call to make_registers
+    creates a separate SimulatedMap for the named group, available as attribute
+    <name>_map.'''
+
+    def __init__(self, name = 'simulated', prefix = 0, dev_dir = '/dev'):
+        self.name = name
+        self.prefix = prefix
+        self.dev_dir = dev_dir
+        self.__events = 0
+
+    def make_registers(self, name, range, *defines, cached = False):
+        groups, constants = load_defines(*defines)
+        self.add_registers(groups[name], range, cached)
+        return constants
+
+    def add_registers(self, top, range, cached = False):
+        # The range is ignored: the simulated map is sized from the group.
+        register_map = SimulatedMap(top._name, register_modes(top._group))
+        setattr(self, top._name + '_map', register_map)
+        setattr(self, top._name, top(register_map, cached))
+
+    def device_name(self, part):
+        return device_name(self.name, part, self.prefix, self.dev_dir)
+
+    def post_events(self, events):
+        '''Adds events to be returned by the next call to read_events.'''
+        self.__events |= events
+
+    def read_events(self, wait = True, verbose = False):
+        # Nothing can happen while we wait, so just return what we have.
+        events = self.__events
+        self.__events = 0
+        return events
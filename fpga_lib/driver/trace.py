@@ -0,0 +1,182 @@
+# Decoding of register access traces into named field changes
+#
+# A register trace is a sequence of (timestamp, offset, value, write) entries
+# recording raw accesses to the registers of one top level group.  A
+# TraceDecoder turns chunks of trace entries into records of the fields whose
+# values have changed, using the register definitions to name registers and
+# fields.  Reads and writes are tracked separately, as for *RW pairs the same
+# offset reads one register and writes another.  The first access to a register
+# reports all of its fields.  For example:
+#
+#   decoder = load_trace_decoder('TOP', 'registers.in')
+#   for changes in decode_trace(decoder, read_trace('trace.bin')):
+#       for timestamp, field, value, write in changes:
+#           print(timestamp, decoder.names[field], value, 'RW'[write])
+#
+# All the work is done on whole chunks with numpy, so very long traces can be
+# decoded quickly.
+
+import numpy
+
+from fpga_lib import parse
+
+from .field_table import WRITE_ONLY
+
+
+# Layout of trace entries and of decoded changes.  A trace can be any
+# structured array with these fields, and read_trace() reads files of entries in
+# exactly this layout.
+TRACE_DTYPE = numpy.dtype([
+    ('timestamp', numpy.uint64),
+    ('offset', numpy.uint32),
+    ('value', numpy.uint32),
+    ('write', numpy.bool_)])
+
+CHANGE_DTYPE = numpy.dtype([
+    ('timestamp', numpy.uint64),
+    ('field', numpy.uint32),
+    ('value', numpy.uint32),
+    ('write', numpy.bool_)])
+
+
+# Returns list of (name, shift, mask) fields of the registers at offset which
+# are accessed by reads or writes.  Registers without fields are a single 32-bit
+# field, and offsets without any register are named by offset.
+def _slot_fields(index, top, prefix, offset, write):
+    fields = []
+    for register in index.aliases(top, offset):
+        if (register.rw != 'R') if write else (register.rw not in WRITE_ONLY):
+            register_fields = index.fields(register.name)
+            if register_fields:
+                fields.extend(
+                    (field.name[prefix:],) + field.field.range
+                    for field in register_fields)
+            else:
+                fields.append((register.name[prefix:], 0, 32))
+    if not fields:
+        fields.append(('@%d' % offset, 0, 32))
+    return [(name, shift, (1 << width) - 1) for name, shift, width in fields]
+
+
+class TraceDecoder:
+    '''Decodes register traces for the top level group top in the given parse
+    index.  The decoder remembers the last value seen for each register, so
+    successive chunks of a trace should be passed to decode() in order.  Field
+    names are relative to the group and are listed in .names, which is indexed
+    by the field column of the decoded changes.'''
+
+    def __init__(self, index, top):
+        base, length = index.groups[top].range
+        prefix = len(top) + 1
+
+        # Each (offset, write) pair is a slot, numbered offset * 2 + write, with
+        # its fields stored contiguously from field_start[slot].
+        names = []
+        shifts = []
+        masks = []
+        self.__field_start = numpy.zeros(2 * length, dtype = numpy.int64)
+        self.__field_count = numpy.zeros(2 * length, dtype = numpy.int64)
+        for offset in range(length):
+            for write in (0, 1):
+                slot = 2 * offset + write
+                fields = _slot_fields(
+                    index, top, prefix, base + offset, write)
+                self.__field_start[slot] = len(names)
+                self.__field_count[slot] = len(fields)
+                for name, shift, mask in fields:
+                    names.append(name)
+                    shifts.append(shift)
+                    masks.append(mask)
+
+        self.names = numpy.array(names)
+        self.__shifts = numpy.array(shifts, dtype = numpy.uint32)
+        self.__masks = numpy.array(masks, dtype = numpy.uint32)
+        self.__base = base
+        self.__length = length
+        self.reset()
+
+    def reset(self):
+        '''Forgets all register values seen so far.'''
+        self.__last = numpy.zeros(2 * self.__length, dtype = numpy.uint32)
+        self.__known = numpy.zeros(2 * self.__length, dtype = bool)
+
+    def decode(self, entries):
+        '''Decodes a chunk of trace entries into an array of CHANGE_DTYPE
+        records, one for each field whose value has changed.  Entries with
+        offsets outside the group are ignored.'''
+        offsets = entries['offset'].astype(numpy.int64) - self.__base
+        valid = (0 <= offsets) & (offsets < self.__length)
+        if not valid.all():
+            entries = entries[valid]
+            offsets = offsets[valid]
+        values = entries['value'].astype(numpy.uint32)
+        writes = entries['write'].astype(bool)
+        slots = 2 * offsets + writes
+
+        # Find the previous value of each entry's slot: either the preceding
+        # entry for the same slot in this chunk, or the last value remembered
+        # from earlier chunks.
+        order = numpy.argsort(slots, kind = 'stable')
+        sorted_slots = slots[order]
+        sorted_values = values[order]
+        first = numpy.ones(len(order), dtype = bool)
+        first[1:] = sorted_slots[1:] != sorted_slots[:-1]
+        previous = numpy.empty_like(sorted_values)
+        previous[1:] = sorted_values[:-1]
+        previous[first] = self.__last[sorted_slots[first]]
+        known = numpy.ones(len(order), dtype = bool)
+        known[first] = self.__known[sorted_slots[first]]
+
+        # Bits changed by each entry, everything for the first sighting
+        changed = numpy.empty_like(sorted_values)
+        changed[order] = numpy.where(
+            known, sorted_values ^ previous, numpy.uint32(0xFFFFFFFF))
+
+        # Remember the last value of each slot for the next chunk
+        last = numpy.ones(len(order), dtype = bool)
+        last[:-1] = first[1:]
+        self.__last[sorted_slots[last]] = sorted_values[last]
+        self.__known[sorted_slots[last]] = True
+
+        # Expand each entry into one row per field of its slot and keep the
+        # fields with changed bits.
+        counts = self.__field_count[slots]
+        rows = numpy.repeat(numpy.arange(len(slots)), counts)
+        starts = numpy.cumsum(counts) - counts
+        fields = self.__field_start[slots][rows] + \
+            numpy.arange(len(rows)) - numpy.repeat(starts, counts)
+        shifts = self.__shifts[fields]
+        masks = self.__masks[fields]
+        keep = ((changed[rows] >> shifts) & masks) != 0
+        rows = rows[keep]
+        fields = fields[keep]
+
+        result = numpy.empty(len(rows), dtype = CHANGE_DTYPE)
+        result['timestamp'] = entries['timestamp'][rows]
+        result['field'] = fields
+        result['value'] = (values[rows] >> shifts[keep]) & masks[keep]
+        result['write'] = writes[rows]
+        return result
+
+
+def load_trace_decoder(top, *defs_path):
+    index = parse.index.ParseIndex(
+        parse.cached_defs(*defs_path, flatten = True))
+    return TraceDecoder(index, top)
+
+
+# Returns an iterator over chunks of at most chunk_size entries read from a file
+# of TRACE_DTYPE records.
+def read_trace(filename, chunk_size = 1 << 20):
+    with open(filename, 'rb') as input:
+        while True:
+            chunk = numpy.fromfile(input, dtype = TRACE_DTYPE, count = chunk_size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+
+# Returns an iterator over the decoded changes for each chunk of entries.
+def decode_trace(decoder, chunks):
+    for chunk in chunks:
+        yield decoder.decode(chunk)
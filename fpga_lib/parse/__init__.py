@@ -2,6 +2,9 @@
 
 from . import indent
 from . import register_defines
+from . import cache
+from . import session
+from . import index
 
 class FailParse(Exception):
     pass
@@ -14,3 +17,14 @@ def parsed_defs(*defs_path, warn = False, flatten = False, defines = None):
     if flatten:
         defines = register_defines.flatten(defines)
     return defines
+
+
+# Cached version of parsed_defs, returns the parse of the given files from the
+# on-disk parse cache if possible, see the cache module.
+def cached_defs(*defs_path, flatten = False):
+    try:
+        key = cache.cache_key('defs', defs_path, flatten)
+    except OSError:
+        # Let parsed_defs report the missing file
+        return parsed_defs(*defs_path, flatten = flatten)
+    return cache.cached(key, lambda: parsed_defs(*defs_path, flatten = flatten))
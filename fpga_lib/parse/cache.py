@@ -0,0 +1,101 @@
+# Persistent on-disk cache of parse results
+#
+# Parsing large register definition files dominates the startup time of short
+# lived tools, so parse results are pickled into a cache directory keyed by a
+# hash of the contents of every input file.  The key also covers the parser
+# sources, so changes to the parser invalidate the cache.  Any failure to read
+# or write the cache is silently ignored and the result is computed afresh.
+#
+# The cache directory is $FPGA_LIB_CACHE if set, otherwise fpga_lib under
+# $XDG_CACHE_HOME (default ~/.cache).  Setting FPGA_LIB_CACHE to an empty string
+# disables caching.
+
+import os
+import hashlib
+import pickle
+import tempfile
+
+from . import indent
+from . import register_defines
+
+
+# Increment to invalidate all existing cache entries
+CACHE_VERSION = 1
+
+
+def cache_dir():
+    try:
+        return os.environ['FPGA_LIB_CACHE']
+    except KeyError:
+        cache_home = os.environ.get('XDG_CACHE_HOME') or \
+            os.path.join(os.path.expanduser('~'), '.cache')
+        return os.path.join(cache_home, 'fpga_lib')
+
+
+def _hash_file(hash, filename):
+    with open(filename, 'rb') as input:
+        hash.update(input.read())
+
+
+# Hash of the parser sources, computed once on first use
+_parser_hash = []
+
+def _parser_digest():
+    if not _parser_hash:
+        hash = hashlib.sha256()
+        for module in [indent, register_defines]:
+            _hash_file(hash, module.__file__)
+        _parser_hash.append(hash.digest())
+    return _parser_hash[0]
+
+
+# Computes the cache key for the given kind of result computed from the given
+# files and extra arguments.
+def cache_key(kind, filenames, *args):
+    hash = hashlib.sha256()
+    hash.update(repr((CACHE_VERSION, kind, args)).encode())
+    hash.update(_parser_digest())
+    for filename in filenames:
+        hash.update(b'\0')
+        _hash_file(hash, filename)
+    return hash.hexdigest()
+
+
+def _load(path):
+    try:
+        with open(path, 'rb') as input:
+            return (True, pickle.load(input))
+    except Exception:
+        return (False, None)
+
+
+def _save(directory, path, value):
+    try:
+        os.makedirs(directory, exist_ok = True)
+        # Write to a temporary file and rename so that concurrent readers never
+        # see a partially written entry.
+        fd, temp = tempfile.mkstemp(dir = directory, suffix = '.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                pickle.dump(value, output, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, path)
+        except Exception:
+            os.unlink(temp)
+            raise
+    except Exception:
+        pass
+
+
+# Returns compute(), cached on disk under the given key.
+def cached(key, compute):
+    directory = cache_dir()
+    if not directory:
+        return compute()
+
+    path = os.path.join(directory, key + '.pickle')
+    found, value = _load(path)
+    if not found:
+        value = compute()
+        _save(directory, path, value)
+    return value
+
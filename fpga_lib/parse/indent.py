@@ -36,122 +36,122 @@ from collections import namedtuple
 Parse = namedtuple('Parse', ['line', 'body', 'doc', 'line_no'])
 
 
-class read_lines:
-    # Line classification
-    EOF = 0         # End of file
-    BLANK = 1       # Blank line, used for comment separation
-    COMMENT = 2     # Documentation line
-    LINE = 3        # Body line
+# Line classification
+EOF = 0         # End of file
+BLANK = 1       # Blank line, used for comment separation
+COMMENT = 2     # Documentation line
+LINE = 3        # Body line
+
 
+# Reads and classifies all the lines of the input file in a single pass.  The
+# result is a list of (token, indent, line, line_no) tuples terminated by an EOF
+# token.  Lines starting with ## are dropped here.  The parse consumes this list
+# by advancing pos.
+class read_lines:
     def __init__(self, input, warn):
-        self.__input = input
-        self.__undo = False
-        self.__result = ()
         self.__warn = warn
-        self.line_no = 0
-
-
-    def fail(self, message):
-        from . import FailParse
-        raise FailParse('Indent error: %s on line %d' % (message, self.line_no))
-
-    def warn(self, message):
-        if self.__warn:
-            print('Warning: %s on line %d' % (message, self.line_no),
-                file = sys.stderr)
 
+        lines = input.read().split('\n')
+        # The text after the last newline should be empty
+        last_line = lines.pop()
+        self.__missing_newline = bool(last_line)
+        if last_line:
+            lines.append(last_line)
+        self.__last_line_no = len(lines)
 
-    def __read_line(self):
-        line = self.__input.readline()
-        self.line_no += 1
-        if line:
-            if line[-1] != '\n':
-                self.fail('Missing newline at end of file')
+        tokens = []
+        for line_no, line in enumerate(lines, 1):
             content = line.lstrip(' ')
-            if content == '\n':
-                return (self.BLANK, 0, '')
+            if not content:
+                tokens.append((BLANK, 0, '', line_no))
+            elif content[0] == '#':
+                if content[:2] != '##':
+                    tokens.append(
+                        (COMMENT, len(line) - len(content), content[1:],
+                            line_no))
             else:
-                indent = len(line) - len(content)
-                if content.startswith('##'):
-                    return None
-                elif content.startswith('#'):
-                    return (self.COMMENT, indent, content[1:-1])
-                else:
-                    return (self.LINE, indent, content[:-1])
-        else:
-            return (self.EOF, 0, '')
+                tokens.append(
+                    (LINE, len(line) - len(content), content, line_no))
+        tokens.append((EOF, 0, '', len(lines) + 1))
+
+        self.tokens = tokens
+        self.pos = 0
 
-    def __fill(self, undo):
-        if not self.__undo:
-            while True:
-                self.__result = self.__read_line()
-                if self.__result:
-                    break
-        self.__undo = undo
-        return self.__result
 
-    def read_line(self):
-        return self.__fill(False)
+    # If the file doesn't end with a newline then reading the last line is an
+    # error, so any report from there on becomes this error.
+    def __check_newline(self, line_no):
+        if self.__missing_newline and line_no >= self.__last_line_no:
+            self.__missing_newline = False
+            self.fail('Missing newline at end of file', self.__last_line_no)
+
+    def fail(self, message, line_no):
+        self.__check_newline(line_no)
+        from . import FailParse
+        raise FailParse('Indent error: %s on line %d' % (message, line_no))
 
-    def lookahead(self):
-        return self.__fill(True)
+    def warn(self, message, line_no):
+        self.__check_newline(line_no)
+        if self.__warn:
+            print('Warning: %s on line %d' % (message, line_no),
+                file = sys.stderr)
 
-    def undo(self):
-        self.__undo = True
+    # Called when the parse is complete.  Note that the parse can finish early
+    # without reaching the end of the file.
+    def check_eof(self):
+        self.__check_newline(self.tokens[self.pos][3])
 
 
 # First gather together any comments with the correct indent as a documentation
 # block.  We allow a blank line to discard comments so we can also have true
 # comments.
 def parse_comments(input, indent):
+    tokens = input.tokens
+    pos = input.pos
     comments = []
     while True:
-        token, new_indent, line = input.read_line()
+        token, new_indent, line, line_no = tokens[pos]
 
-        if token == input.BLANK:
+        if token == BLANK:
             if comments:
-                input.warn('Discarding inline comments')
+                input.warn('Discarding inline comments', line_no)
             comments = []
-        elif token == input.COMMENT:
+        elif token == COMMENT:
             if indent != new_indent:
-                input.fail('Bad comment indentation')
-            if line and line[0] == '#':
-                # Discard all lines with ## comment prefix; these act as true
-                # comments rather than documentation lines.
-                pass
-            else:
-                comments.append(line)
+                input.fail('Bad comment indentation', line_no)
+            comments.append(line)
         else:
-            input.undo()
+            input.pos = pos
             return comments
+        pos += 1
 
 
 def parse_line(input, indent):
     comments = parse_comments(input, indent)
-    token, new_indent, line = input.read_line()
-    line_no = input.line_no
+    token, new_indent, line, line_no = input.tokens[input.pos]
 
-    if token == input.EOF:
+    if token == EOF:
         if comments:
-            input.warn('Discarding comments at end of file')
+            input.warn('Discarding comments at end of file', line_no)
         return None
     else:
-        assert token == input.LINE
+        input.pos += 1
         if new_indent != indent:
-            input.fail('Invalid identation')
+            input.fail('Invalid identation', line_no)
 
         sub_lines = parse_sub_lines(input, indent)
         return Parse(line, sub_lines, comments, line_no)
 
 
+# Skips blank lines and returns the indentation of the next line, or 0 at end of
+# file.
 def find_new_indent(input):
-    while True:
-        token, indent, _ = input.read_line()
-        if token == input.EOF:
-            return 0
-        elif token != input.BLANK:
-            input.undo()
-            return indent
+    tokens = input.tokens
+    pos = input.pos
+    while tokens[pos][0] == BLANK:
+        pos += 1
+    input.pos = pos
+    return tokens[pos][1]
 
 
 def parse_sub_lines(input, indent):
@@ -159,22 +159,26 @@ def parse_sub_lines(input, indent):
     new_indent = find_new_indent(input)
     if new_indent > indent:
         indent = new_indent
+        tokens = input.tokens
         while True:
             line = parse_line(input, indent)
             if line:
                 lines.append(line)
             else:
                 break
-            _, new_indent, _ = input.lookahead()
+            _, new_indent, _, line_no = tokens[input.pos]
             if new_indent > indent:
-                input.fail('Invalid indentation')
+                input.fail('Invalid indentation', line_no)
             elif new_indent < indent:
                 break
     return lines
 
 
 def parse_file(input, warn = True):
-    return parse_sub_lines(read_lines(input, warn), -1)
+    input = read_lines(input, warn)
+    parse = parse_sub_lines(input, -1)
+    input.check_eof()
+    return parse
 
 
 def print_parse(prefix, parse):
@@ -0,0 +1,125 @@
+# Symbol table for a flattened register parse
+#
+# Walking the parse tree to find a register is linear in the size of the tree.
+# An index is built once from a flattened parse and maps full dotted names such
+# as TOP.GROUP.REG.FIELD to symbols, and register offsets within each top level
+# group to all the registers at that offset, including rw pairs, overlays and
+# unions.  For example:
+#
+#   index = ParseIndex(parse.parsed_defs('registers.in', flatten = True))
+#   index['TOP.CONTROL.ENABLE'].field.range
+#   [symbol.name for symbol in index.aliases('TOP', 4)]
+#
+# Register array elements are named with their index, as in TOP.DATA[3].LOW.
+
+from collections import namedtuple
+
+from . import register_defines
+
+
+# Each symbol is either a register, in which case field is None, or a field of
+# register.  The top is the name of the enclosing top level group, and offset
+# is the register offset within this group.  For array elements register is the
+# RegisterArray.
+Symbol = namedtuple('Symbol',
+    ['name', 'top', 'offset', 'rw', 'register', 'field'])
+
+
+class IndexMethods(register_defines.WalkParse):
+    def __init__(self, index, top):
+        self.index = index
+        self.top = top
+
+    def __add_register(self, prefix, name, offset, rw, register):
+        name = prefix + name
+        symbol = Symbol(name, self.top, offset, rw, register, None)
+        self.index._add_register(symbol)
+        for field in register.fields:
+            self.index._add_field(name, symbol._replace(
+                name = name + '.' + field.name, field = field))
+
+    def walk_field(self, prefix, field):
+        assert False
+
+    def walk_register(self, prefix, register):
+        self.__add_register(
+            prefix, register.name, register.offset, register.rw, register)
+
+    def walk_register_array(self, prefix, array):
+        base, length = array.range
+        for n in range(length):
+            self.__add_register(
+                prefix, '%s[%d]' % (array.name, n), base + n, array.rw, array)
+
+    def walk_group(self, prefix, group):
+        if not group.hidden:
+            prefix = prefix + group.name + '.'
+        self.walk_subgroups(prefix, group)
+
+    def walk_rw_pair(self, prefix, rw_pair):
+        for register in rw_pair.registers:
+            self.walk_register(prefix, register)
+
+    def walk_overlay(self, prefix, overlay):
+        prefix = prefix + overlay.name + '.'
+        for register in overlay.registers:
+            self.walk_register(
+                prefix, register._replace(offset = overlay.offset))
+
+    def walk_union(self, prefix, union):
+        self.walk_subgroups(prefix, union)
+
+
+class ParseIndex:
+    '''Index of all registers and fields in a flattened parse.  Symbols can be
+    looked up by full dotted name by indexing, and all registers at a given
+    offset within a top level group are returned by aliases().'''
+
+    def __init__(self, parsed):
+        self.constants = parsed.constants
+        self.groups = dict((group.name, group) for group in parsed.groups)
+        self.__names = {}
+        self.__offsets = {}
+        # Register symbols and field symbols for each register in parse order
+        self.__registers = dict((group.name, []) for group in parsed.groups)
+        self.__fields = {}
+
+        for group in parsed.groups:
+            IndexMethods(self, group.name).walk_group('', group)
+
+    def _add_register(self, symbol):
+        self.__add_name(symbol)
+        self.__offsets.setdefault(
+            (symbol.top, symbol.offset), []).append(symbol)
+        self.__registers[symbol.top].append(symbol)
+        self.__fields[symbol.name] = []
+
+    def _add_field(self, register, symbol):
+        self.__add_name(symbol)
+        self.__fields[register].append(symbol)
+
+    def __add_name(self, symbol):
+        assert symbol.name not in self.__names, \
+            'Repeated name %s' % symbol.name
+        self.__names[symbol.name] = symbol
+
+    def __getitem__(self, name):
+        return self.__names[name]
+
+    def __contains__(self, name):
+        return name in self.__names
+
+    def get(self, name, default = None):
+        return self.__names.get(name, default)
+
+    def aliases(self, top, offset):
+        '''Returns list of all register symbols at offset in group top.'''
+        return self.__offsets.get((top, offset), [])
+
+    def registers(self, top):
+        '''Returns list of all register symbols in group top in parse order.'''
+        return self.__registers[top]
+
+    def fields(self, register):
+        '''Returns list of field symbols for the named register.'''
+        return self.__fields[register]
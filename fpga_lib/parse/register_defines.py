@@ -623,13 +623,14 @@ def extend_defines(defines, list):
         defines[entry.name] = entry
 
 
-# Extracts defines, groups and constants from parsed structure.
+# Extracts defines, groups and constants from parsed structure.  The constants
+# are copied so that the incoming parse is left unchanged and can be reused.
 def gather_parse_defs(parsed):
     defines = OrderedDict()
     extend_defines(defines, parsed.group_defs)
     extend_defines(defines, parsed.register_defs)
     extend_defines(defines, parsed.groups)
-    return (defines, [], parsed.constants)
+    return (defines, [], OrderedDict(parsed.constants))
 
 
 # ------------------------------------------------------------------------------
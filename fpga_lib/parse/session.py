@@ -0,0 +1,95 @@
+# Parse session for processing many register definition files
+#
+# A ParseSession remembers the parse of every file it reads, keyed by path and
+# modification stamp, so that when many packages include the same common
+# definitions each file is only parsed once.  Trimmed include chains are
+# remembered in the same way.  For example:
+#
+#   session = ParseSession()
+#   for input, includes, output in packages:
+#       if session.needs_update(output, [input] + includes):
+#           parsed = session.parsed_defs(input, includes)
+#           ...
+
+import os
+
+from . import indent
+from . import register_defines
+
+
+def file_stamp(filename):
+    stat = os.stat(filename)
+    return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+
+class ParseSession:
+    def __init__(self, warn = False):
+        self.warn = warn
+        # Indent parses indexed by file stamp
+        self.__indent = {}
+        # Trimmed include parses indexed by tuple of file stamps
+        self.__includes = {(): register_defines.empty_parse()}
+        # Definition parses indexed by file stamp and includes
+        self.__defs = {}
+
+    # Records the file being parsed in any parse failure
+    def __parse(self, filename, parse, *args):
+        from . import FailParse
+        try:
+            return parse(*args)
+        except FailParse as e:
+            if not hasattr(e, 'filename'):
+                e.filename = filename
+            raise
+
+    def indent_parse(self, filename):
+        stamp = file_stamp(filename)
+        try:
+            return self.__indent[stamp]
+        except KeyError:
+            with open(filename) as input:
+                result = self.__parse(
+                    filename, indent.parse_file, input, self.warn)
+            self.__indent[stamp] = result
+            return result
+
+    # Returns the trimmed parse of the given list of include files, each file
+    # being parsed with the definitions of the files before it.
+    def includes(self, filenames):
+        stamps = tuple(map(file_stamp, filenames))
+        try:
+            return self.__includes[stamps]
+        except KeyError:
+            # Reuse the longest chain we already have
+            parsed = self.includes(filenames[:-1])
+            filename = filenames[-1]
+            parsed = register_defines.trim_parse(self.__parse(
+                filename, register_defines.parse_defs,
+                self.indent_parse(filename), parsed))
+            self.__includes[stamps] = parsed
+            return parsed
+
+    # Returns the parse of filename using the definitions in includes, as for
+    # tools/register_defines.
+    def parsed_defs(self, filename, includes = []):
+        includes = list(includes)
+        key = (file_stamp(filename), tuple(map(file_stamp, includes)))
+        try:
+            return self.__defs[key]
+        except KeyError:
+            result = self.__parse(
+                filename, register_defines.parse_defs,
+                self.indent_parse(filename), self.includes(includes))
+            self.__defs[key] = result
+            return result
+
+    # Returns whether output needs to be regenerated from the given inputs,
+    # namely if it is missing or older than any input.
+    def needs_update(self, output, inputs):
+        try:
+            output_time = os.stat(output).st_mtime_ns
+        except FileNotFoundError:
+            return True
+        return any(
+            file_stamp(input)[1] > output_time
+            for input in inputs)